@@ -1,15 +1,23 @@
+import os
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_marshmallow import Marshmallow
+from database import DEFAULT_DATABASE_URI, configure_database, init_engines, RoutingSession
 
 # Init App
 app = Flask(__name__)
+# any config can be set from the environment, e.g. ASSAY_DB_POOL_SIZE=20
+app.config.from_prefixed_env("ASSAY")
 # Database config
-app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///assay-plate-service.db"
+configure_database(
+    app,
+    os.environ.get("ASSAY_DATABASE_URI", DEFAULT_DATABASE_URI),
+    os.environ.get("ASSAY_READ_DATABASE_URI")
+)
 
 # Init db
-db = SQLAlchemy(app)
+db = SQLAlchemy(app, session_options={'class_': RoutingSession})
+init_engines(app, db)
 # Init Marshmallow
 ma = Marshmallow(app)
 
@@ -18,4 +26,6 @@ from routes import *
 
 # Run Server
 if __name__ == '__main__':
-    app.run(debug=True)
\ No newline at end of file
+    from campaigns import resume_campaigns
+    resume_campaigns()
+    app.run(debug=True)
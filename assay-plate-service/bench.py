@@ -0,0 +1,276 @@
+"""
+Load test the service end to end through the Flask test client against a
+fresh SQLite database, and save the results as JSON so runs can be compared.
+
+    python bench.py                                  # run and save to bench_results/
+    python bench.py --baseline bench_results/a.json  # and flag regressions against an earlier run
+    python bench.py --quick                          # fewer iterations and smaller databases
+
+Each scenario reports p50/p95/mean latency, throughput, SQL statements per
+request and the peak Python memory of one extra traced run. Read scenarios
+are repeated as the database grows. The exit status is 1 when any scenario
+regressed against the baseline.
+"""
+import argparse
+import atexit
+import datetime
+import json
+import os
+import platform
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# point the app at a throwaway database before it's imported
+_bench_dir = tempfile.mkdtemp(prefix='assay-bench-')
+atexit.register(shutil.rmtree, _bench_dir, ignore_errors=True)
+os.environ['ASSAY_DATABASE_URI'] = f"sqlite:///{os.path.join(_bench_dir, 'bench.db')}"
+
+from app import app, db  # noqa: E402
+from metrics import StatementCounter  # noqa: E402
+from cache import plate_response_cache  # noqa: E402
+
+PLATE_SIZES = (96, 384, 1536)
+N_POINTS = 10
+
+
+class Bench:
+    """runs scenarios against one test client and collects their results"""
+
+    def __init__(self, iterations: int):
+        self.iterations = iterations
+        self.client = app.test_client()
+        self.results = {}
+
+    def request(self, method: str, url: str, **kwargs):
+        response = self.client.open(url, method=method, **kwargs)
+        if response.status_code >= 400:
+            raise RuntimeError(f"{method} {url} failed with {response.status_code}: {response.get_data(as_text=True)[:200]}")
+        return response
+
+    def run(self, name: str, call, iterations: int = None, count_statements: bool = True) -> list:
+        """
+        Time call over and over, counting SQL statements per call, then run it
+        once more under tracemalloc for peak memory. call gets the iteration
+        number. Returns what each timed call returned. Statement counts only
+        see this thread, so scenarios that do their work on other threads
+        pass count_statements=False and report None.
+        """
+        iterations = iterations or self.iterations
+        times, statements, returned = [], [], []
+        started = time.perf_counter()
+        for i in range(iterations):
+            with StatementCounter() as counter:
+                returned.append(call(i))
+            times.append(counter.elapsed)
+            statements.append(counter.count)
+        total = time.perf_counter() - started
+
+        tracemalloc.start()
+        call(iterations)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        times.sort()
+        self.results[name] = {
+            'iterations': iterations,
+            'p50_ms': round(statistics.median(times) * 1000, 3),
+            'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))] * 1000, 3),
+            'mean_ms': round(statistics.fmean(times) * 1000, 3),
+            'throughput_per_s': round(iterations / total, 2),
+            'statements': round(statistics.fmean(statements), 2) if count_statements else None,
+            'peak_memory_mb': round(peak / 1e6, 3),
+        }
+        stmts = '-' if not count_statements else f"{self.results[name]['statements']:.1f}"
+        print(f"{name:<40} p50 {self.results[name]['p50_ms']:>9.2f} ms  p95 {self.results[name]['p95_ms']:>9.2f} ms"
+              f"  {stmts:>7} stmts  {self.results[name]['peak_memory_mb']:>8.2f} MB")
+        return returned
+
+    # Scenarios
+    def create_plates(self) -> dict:
+        """POST /plates for every plate size. returns a fresh plate id per size"""
+        plate_ids = {}
+        for size in PLATE_SIZES:
+            ids = self.run(f'create_plate_{size}', lambda i: self.request(
+                'POST', '/plates', json={'name': f'bench {size} {i}', 'size': size}).get_json()['id'])
+            plate_ids[size] = ids
+        return plate_ids
+
+    def fill_wells(self, plate_ids: dict, max_wells: int) -> None:
+        """single well POSTs, one plate per size, up to max_wells of it"""
+        for size in PLATE_SIZES:
+            plate_id = plate_ids[size][0]
+            num_cols = {96: 12, 384: 24, 1536: 48}[size]
+            wells = min(size, max_wells)
+
+            def fill(i):
+                row, col = divmod(i % size, num_cols)
+                return self.request('POST', f'/plates/{plate_id}/wells', json={
+                    'row': row, 'col': col, 'cell_line': 'c1',
+                    'chemical': f'O{i % 50 + 1}', 'concentration': float(i)
+                })
+            self.run(f'fill_well_{size}', fill, iterations=wells)
+
+    def concurrent_fill(self, clients: int, wells_per_client: int) -> None:
+        """
+        clients threads POSTing single wells to one 1536 well plate at the
+        same time, with and without write coalescing. Each iteration is one
+        round of clients * wells_per_client writes.
+        """
+        for coalescing in (False, True):
+            app.config['WRITE_COALESCING'] = coalescing
+
+            def round_of_writes(i):
+                plate_id = self.request('POST', '/plates', json={'name': f'concurrent {i}', 'size': 1536}).get_json()['id']
+                failures = []
+
+                def client(c):
+                    http = app.test_client()
+                    for w in range(wells_per_client):
+                        index = c * wells_per_client + w
+                        response = http.post(f'/plates/{plate_id}/wells', json={
+                            'row': index // 48, 'col': index % 48, 'cell_line': 'c1',
+                            'chemical': f'O{index % 50 + 1}', 'concentration': float(index)
+                        })
+                        if response.status_code >= 400:
+                            failures.append(response.get_data(as_text=True)[-300:])
+                threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+                for thread in threads:
+                    thread.start()
+                for thread in threads:
+                    thread.join()
+                if failures:
+                    raise RuntimeError(f"{len(failures)} concurrent well POSTs failed: {failures[0]}")
+
+            name = f"concurrent_fill_{clients}x{wells_per_client}{'_coalesced' if coalescing else ''}"
+            # the writes happen on the client threads, and the writer thread when coalescing,
+            # where this thread's statement counter can't see them
+            self.run(name, round_of_writes, iterations=max(3, self.iterations // 5), count_statements=False)
+        app.config['WRITE_COALESCING'] = False
+
+    def drc(self, plate_ids: dict) -> None:
+        """POST /plates/<id>/drc with as many chemicals as fill the plate"""
+        for size in PLATE_SIZES:
+            ids = plate_ids[size]
+            n_chemicals = (size - 1) // N_POINTS
+            self.run(f'drc_{size}_{n_chemicals}_chemicals', lambda i: self.request(
+                'POST', f'/plates/{ids[i % len(ids)]}/drc', json={
+                    'cell_line': 'c2',
+                    'chemicals': [f'O{c + 1}' for c in range(n_chemicals)],
+                    'min_concentration': 0.01,
+                    'max_concentration': 100,
+                    'n_points': N_POINTS,
+                    'control_chemical': 'O9999',
+                    'control_concentration': 1
+                }), iterations=min(self.iterations, len(ids)))
+
+    def grow(self, template_id: int, n_plates: int) -> None:
+        """clone a filled plate until the database holds n_plates"""
+        with app.app_context():
+            existing = db.session.execute(db.text('SELECT count(*) FROM plate')).scalar_one()
+        while existing < n_plates:
+            copies = min(100, n_plates - existing)
+            self.request('POST', f'/plates/{template_id}/clone?copies={copies}')
+            existing += copies
+
+    def reads(self, db_size: int, plate_id: int) -> None:
+        """the read endpoints, with and without the response cache"""
+        def cold(url):
+            def call(i):
+                plate_response_cache.clear()
+                return self.request('GET', url)
+            return call
+
+        self.run(f'get_plates_summaries@{db_size}', lambda i: self.request('GET', '/plates?wells=false'))
+        self.run(f'get_plates_page_20@{db_size}', lambda i: self.request('GET', '/plates?limit=20'))
+        self.run(f'get_plate_wells_cached@{db_size}', lambda i: self.request('GET', f'/plates/{plate_id}/wells'))
+        self.run(f'get_plate_wells_uncached@{db_size}', cold(f'/plates/{plate_id}/wells'))
+        self.run(f'get_chemicals@{db_size}', lambda i: self.request('GET', '/chemicals'))
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """scenarios whose p50 got more than threshold slower, or that issue more SQL"""
+    regressions = []
+    for name, result in results.items():
+        before = baseline.get(name)
+        if before is None:
+            continue
+        if result['p50_ms'] > before['p50_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p50 {before['p50_ms']} ms -> {result['p50_ms']} ms")
+        if result['statements'] is not None and before['statements'] is not None and \
+                result['statements'] > before['statements']:
+            regressions.append(f"{name}: statements {before['statements']} -> {result['statements']}")
+    return regressions
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        return ''
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=30)
+    parser.add_argument('--fill-wells', type=int, default=384, help='single well POSTs per plate size')
+    parser.add_argument('--clients', type=int, default=16, help='threads in the concurrent write scenario')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10, 100, 500],
+                        help='database sizes, in plates, to measure reads at')
+    parser.add_argument('--quick', action='store_true', help='5 iterations, 48 wells, sizes 10 and 50')
+    parser.add_argument('--out', default=None, help='where to save results (default bench_results/<time>.json)')
+    parser.add_argument('--baseline', default=None, help='earlier results to check for regressions against')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p50 slowdown that counts as a regression')
+    args = parser.parse_args()
+    if args.quick:
+        args.iterations, args.fill_wells, args.sizes = 5, 48, [10, 50]
+
+    with app.app_context():
+        db.create_all()
+    bench = Bench(args.iterations)
+    plate_ids = bench.create_plates()
+    bench.fill_wells(plate_ids, args.fill_wells)
+    bench.concurrent_fill(args.clients, min(args.fill_wells, 1536 // args.clients))
+    bench.drc(plate_ids)
+    template_id = plate_ids[384][-1]
+    for db_size in sorted(args.sizes):
+        bench.grow(template_id, db_size)
+        bench.reads(db_size, template_id)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    report = {
+        'meta': {
+            'time': now.isoformat(timespec='seconds'),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'args': vars(args),
+        },
+        'scenarios': bench.results,
+    }
+    out = args.out or os.path.join('bench_results', now.strftime('%Y%m%dT%H%M%SZ') + '.json')
+    os.makedirs(os.path.dirname(out) or '.', exist_ok=True)
+    with open(out, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"saved {out}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(bench.results, json.load(f)['scenarios'], args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+        print("no regressions")
+
+
+if __name__ == '__main__':
+    main()
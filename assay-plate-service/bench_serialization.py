@@ -0,0 +1,78 @@
+"""
+Compare the marshmallow schemas with serializers.py on a full 1536 well
+plate, and check both produce the same JSON.
+
+    python bench_serialization.py [repeats]
+
+It runs against a throwaway SQLite database, like bench.py, so the
+development database is never touched.
+"""
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import time
+import statistics
+import numpy as np
+
+# point the app at a throwaway database before it's imported
+_bench_dir = tempfile.mkdtemp(prefix='assay-bench-serialization-')
+atexit.register(shutil.rmtree, _bench_dir, ignore_errors=True)
+os.environ['ASSAY_DATABASE_URI'] = f"sqlite:///{os.path.join(_bench_dir, 'bench.db')}"
+
+from app import app, db  # noqa: E402
+from model import Plate, Well, plate_schema, wells_schema  # noqa: E402
+from layout import PlateLayout  # noqa: E402
+from serializers import plate_json, wells_json  # noqa: E402
+from sqlalchemy.orm import subqueryload  # noqa: E402
+
+
+def timed(fn, repeats: int):
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = fn()
+        times.append(time.perf_counter() - start)
+    return result, statistics.median(times) * 1000
+
+
+def main(repeats: int = 20):
+    with app.app_context():
+        db.create_all()
+        plate = Plate(name='serialization benchmark', size=1536)
+        db.session.add(plate)
+        db.session.flush()
+        layout = PlateLayout(plate)
+        wells = np.arange(plate.size)
+        layout.assign(wells, cell_line='c1', chemicals=['O1', 'O2'], concentrations=np.c_[wells * 0.5, wells * 0.25])
+        layout.flush()
+
+        def schema_plate():
+            db.session.expire_all()
+            loaded = Plate.query.options(subqueryload(Plate.wells).subqueryload(Well.chemicals)).filter_by(id=plate.id).first()
+            return plate_schema.jsonify(loaded).get_data()
+
+        def schema_wells():
+            db.session.expire_all()
+            loaded = Well.query.options(subqueryload(Well.chemicals)).filter_by(plate_id=plate.id).order_by(Well.index)
+            return wells_schema.jsonify(loaded).get_data()
+
+        def fast_plate():
+            return plate_json(db.session.get(Plate, plate.id))
+
+        def fast_wells():
+            return wells_json(db.session.get(Plate, plate.id))
+
+        try:
+            print(f"{'response':<10} {'marshmallow ms':>15} {'serializers ms':>15} {'speedup':>8}  same json")
+            for name, slow, fast in (('plate', schema_plate, fast_plate), ('wells', schema_wells, fast_wells)):
+                expected, slow_ms = timed(slow, repeats)
+                actual, fast_ms = timed(fast, repeats)
+                print(f"{name:<10} {slow_ms:>15.2f} {fast_ms:>15.2f} {slow_ms / fast_ms:>7.1f}x  {actual == expected}")
+        finally:
+            db.session.rollback()
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
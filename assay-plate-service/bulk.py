@@ -0,0 +1,249 @@
+from typing import Dict, List, Optional, Tuple, NamedTuple
+import numpy as np
+from sqlalchemy import select, insert, delete, literal
+from sqlalchemy.orm import aliased
+from app import app, db
+from exceptions import InvalidWellContents, WellOutOfBounds, InvalidPlateData
+from model import Plate, Well, ChemicalInWell, DoseResponseCurve, WellChange, check_cell_line, check_chemical_str_id, \
+    check_concentration, pair_chemicals, upsert_wells, upsert_chemicals_in_wells, record_well_changes
+from registry import chemical_registry
+from metrics import timed
+from validation import identifier_errors, concentration_errors, position_errors, first_occurrences, errors_list
+
+
+class WellSpec(NamedTuple):
+    """fully validated contents for a single well, ready to be written"""
+    index: int
+    cell_line: Optional[str]
+    chemicals: List[str]
+    concentrations: List[Optional[float]]
+
+
+class WellEntry(NamedTuple):
+    """one well entry from a request payload with its shape checked, but not yet its values"""
+    index: Optional[int]
+    row: Optional[int]
+    col: Optional[int]
+    cell_line: Optional[str]
+    chemicals: List[str]
+    concentrations: List[Optional[float]]
+
+
+def read_well_entry(entry: dict) -> WellEntry:
+    """
+    The fields of one well entry, checked for type and shape only. Entries
+    may address the well by 'index' or by 'row' and 'col'. Concentrations
+    are left to check_concentration.
+    """
+    if not isinstance(entry, dict):
+        raise InvalidWellContents(f"Well entries must be objects, not '{entry}'.")
+    index = row = col = None
+    if entry.get('index') is not None:
+        index = entry['index']
+        if type(index) != int:
+            raise WellOutOfBounds(f"Well index '{index}' must be an integer.")
+    else:
+        row = entry['row']
+        col = entry['col']
+        if type(row) != int or type(col) != int:
+            raise WellOutOfBounds(f"Well position ({row}, {col}) must be given as integers.")
+
+    cell_line = entry.get('cell_line')
+    if cell_line is not None and type(cell_line) != str:
+        raise InvalidWellContents(f"'{cell_line}' is not a valid cell line identifier.")
+
+    chemical = entry.get('chemical')
+    concentration = entry.get('concentration')
+    if concentration and not chemical:
+        raise InvalidWellContents(
+            f"No concentration may be specified without assigning a chemical to the well."
+        )
+    if chemical is not None and type(chemical) != str and not (
+            type(chemical) == list and all(type(c) == str for c in chemical)):
+        raise InvalidWellContents(f"'{chemical}' is not a valid chemical identifier.")
+    chemicals, concentrations = pair_chemicals(chemical, concentration)
+    if len(set(chemicals)) != len(chemicals):
+        raise InvalidWellContents(f"A chemical may only be listed once per well: {chemicals}")
+    return WellEntry(index, row, col, cell_line, chemicals, concentrations)
+
+
+def parse_well_spec(plate: Plate, entry: dict) -> WellSpec:
+    """Turn one well entry from a request payload into a WellSpec"""
+    well = read_well_entry(entry)
+    if well.index is not None:
+        plate.check_index(well.index)
+        index = well.index
+    else:
+        index = plate.get_index(well.row, well.col)
+    check_cell_line(well.cell_line)
+    for str_id in well.chemicals:
+        check_chemical_str_id(str_id)
+    for conc in well.concentrations:
+        check_concentration(conc)
+    return WellSpec(index, well.cell_line, well.chemicals, well.concentrations)
+
+
+@timed('validate_wells')
+def parse_well_specs(plate: Plate, entries: list) -> Tuple[List[WellSpec], List[dict]]:
+    """
+    Validate a whole batch payload before anything is written, reporting
+    every bad entry rather than stopping at the first one. Each entry's
+    shape is read first, then the batch is checked as a whole: every
+    position bounds checked as an array, each distinct cell line and
+    chemical matched once, and every concentration checked as one array.
+    Only an entry's first problem is reported.
+    """
+    if not isinstance(entries, list):
+        return [], [{'entry': None, 'error': "'wells' must be a list of well entries."}]
+    errors: Dict[int, str] = {}
+    wells: Dict[int, WellEntry] = {}
+    for i, entry in enumerate(entries):
+        try:
+            wells[i] = read_well_entry(entry)
+        except KeyError as e:
+            errors[i] = f"Missing required field: {e}"
+        except (InvalidWellContents, WellOutOfBounds) as e:
+            errors[i] = str(e)
+
+    numbers = list(wells)
+    indices, bad_positions = position_errors(
+        plate,
+        [wells[i].index for i in numbers],
+        [wells[i].row for i in numbers],
+        [wells[i].col for i in numbers]
+    )
+    for position, error in bad_positions.items():
+        errors[numbers[position]] = error
+
+    bad_cell_lines = identifier_errors((well.cell_line for well in wells.values() if well.cell_line is not None), check_cell_line)
+    bad_chemicals = identifier_errors((str_id for well in wells.values() for str_id in well.chemicals),
+                                      check_chemical_str_id)
+    owners = [i for i in numbers for _ in wells[i].concentrations]
+    bad_concentrations = concentration_errors([conc for i in numbers for conc in wells[i].concentrations])
+    for i in numbers:
+        well = wells[i]
+        if i in errors:
+            continue
+        if well.cell_line in bad_cell_lines:
+            errors[i] = bad_cell_lines[well.cell_line]
+        else:
+            for str_id in well.chemicals:
+                if str_id in bad_chemicals:
+                    errors[i] = bad_chemicals[str_id]
+                    break
+    for position, error in bad_concentrations.items():
+        errors.setdefault(owners[position], error)
+
+    # of the entries left, the first to claim a well gets it
+    valid = np.array([position for position, i in enumerate(numbers) if i not in errors], dtype=np.int64)
+    valid_indices = indices[valid]
+    claimed_by = valid[first_occurrences(valid_indices)] if len(valid) else valid
+    specs = []
+    for position, index, first in zip(valid.tolist(), valid_indices.tolist(), claimed_by.tolist()):
+        i = numbers[position]
+        if first != position:
+            errors[i] = f"Well index {index} is already set by entry {numbers[first]}."
+            continue
+        well = wells[i]
+        specs.append(WellSpec(index, well.cell_line, well.chemicals, well.concentrations))
+    return specs, errors_list(errors)
+
+
+@timed('write_wells')
+def write_wells(plate: Plate, specs: List[WellSpec], op: str = 'set') -> None:
+    """
+    Create or overwrite every well in specs with a fixed number of bulk
+    statements. Nothing is committed here so the caller owns the transaction.
+    op is what the writes are logged as in the plate's change feed.
+    """
+    if not specs:
+        return
+    # only wells with something in them are stored, so emptied wells are removed
+    empty = [spec.index for spec in specs if not spec.cell_line and not spec.chemicals]
+    plate.clear_wells(empty)
+    specs = [spec for spec in specs if spec.cell_line or spec.chemicals]
+    if not specs:
+        return
+    record_well_changes(plate.id, [spec.index for spec in specs], op)
+
+    # register any chemicals we haven't seen before
+    chemical_registry.ensure([str_id for spec in specs for str_id in spec.chemicals])
+
+    # clear out the old chemicals of any well we're overwriting, then create
+    # or overwrite the wells themselves in one upsert
+    indices = [spec.index for spec in specs]
+    db.session.execute(delete(ChemicalInWell).where(ChemicalInWell.well_id.in_(
+        select(Well.id).where(Well.plate_id == plate.id, Well.index.in_(indices))
+    )))
+    upsert_wells(plate.id, [{'index': spec.index, 'cell_line': spec.cell_line} for spec in specs])
+
+    well_ids = dict(db.session.execute(
+        select(Well.index, Well.id).where(Well.plate_id == plate.id, Well.index.in_(indices))
+    ).all())
+    upsert_chemicals_in_wells([
+        {'chemical_str_id': str_id, 'well_id': well_ids[spec.index], 'concentration': conc}
+        for spec in specs
+        for str_id, conc in zip(spec.chemicals, spec.concentrations)
+    ])
+
+
+MAX_CLONE_COPIES = app.config.get('MAX_CLONE_COPIES', 100)
+
+
+@timed('clone_plate')
+def clone_plate(plate: Plate, copies: int) -> List[int]:
+    """
+    Make copies of a plate with everything on it: wells, their chemicals and
+    the plate's dose response curves. The rows are copied inside the database
+    with one INSERT ... SELECT per table, so the statement count doesn't grow
+    with the number of copies or wells. Every copied well is logged as a
+    'clone' change at version 1 of its new plate. Nothing is committed here.
+    Returns the new plate ids in order.
+    """
+    if type(copies) != int or not 1 <= copies <= MAX_CLONE_COPIES:
+        raise InvalidPlateData(
+            f"copies must be an integer from 1 to {MAX_CLONE_COPIES}, not '{copies}'."
+        )
+    # asking for the ids back in parameter order would make sqlite insert one
+    # plate per statement, so take them in a single batch and sort
+    new_ids = sorted(db.session.scalars(
+        insert(Plate).returning(Plate.id),
+        [{'name': f"{plate.name} copy {i + 1}", 'size': plate.size, 'version': 1} for i in range(copies)]
+    ).all())
+    # the copies start out at version 1, which this transaction gave them
+    db.session.info.setdefault('plate_versions', {}).update({plate_id: 1 for plate_id in new_ids})
+
+    # pair every source row with every new plate
+    copy = aliased(Plate)
+    db.session.execute(insert(Well).from_select(
+        ['plate_id', 'index', 'cell_line'],
+        select(copy.id, Well.index, Well.cell_line)
+        .join(copy, copy.id.in_(new_ids))
+        .where(Well.plate_id == plate.id)
+    ))
+    db.session.execute(insert(WellChange).from_select(
+        ['plate_id', 'version', 'index', 'op'],
+        select(copy.id, literal(1), Well.index, literal('clone'))
+        .join(copy, copy.id.in_(new_ids))
+        .where(Well.plate_id == plate.id)
+    ))
+
+    # the copied wells are found again through the (plate_id, index) index
+    source_well = aliased(Well)
+    copied_well = aliased(Well)
+    db.session.execute(insert(ChemicalInWell).from_select(
+        ['chemical_str_id', 'well_id', 'concentration'],
+        select(ChemicalInWell.chemical_str_id, copied_well.id, ChemicalInWell.concentration)
+        .join(source_well, source_well.id == ChemicalInWell.well_id)
+        .join(copied_well, (copied_well.index == source_well.index) & copied_well.plate_id.in_(new_ids))
+        .where(source_well.plate_id == plate.id)
+    ))
+
+    curve_columns = [column.name for column in DoseResponseCurve.__table__.columns if column.name not in ('id', 'plate_id')]
+    db.session.execute(insert(DoseResponseCurve).from_select(
+        ['plate_id'] + curve_columns,
+        select(copy.id, *[DoseResponseCurve.__table__.c[name] for name in curve_columns])
+        .join(copy, copy.id.in_(new_ids))
+        .where(DoseResponseCurve.plate_id == plate.id)
+    ))
+    return new_ids
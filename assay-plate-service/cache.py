@@ -0,0 +1,38 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+from app import app
+
+
+class ResponseCache:
+    """
+    Bounded LRU of serialized response bodies. Keys include the plate
+    version, so entries never need invalidating: a write moves the plate to
+    a new version and the old entries simply stop being asked for.
+    """
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Optional[bytes]:
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+            return body
+
+    def put(self, key: Hashable, body: bytes) -> None:
+        with self._lock:
+            self._entries[key] = body
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+plate_response_cache = ResponseCache(max_entries=app.config.get('PLATE_CACHE_SIZE', 256))
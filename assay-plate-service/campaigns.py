@@ -0,0 +1,147 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+from sqlalchemy import insert, update, select, inspect
+from app import app, db
+from exceptions import InvalidPlateData, WellOutOfBounds
+from model import Plate, Campaign
+from drc import check_drc_settings, plan_dose_response_curves, write_dose_response_plan
+
+logger = logging.getLogger(__name__)
+
+# campaign plates are planned and written here, off the request thread
+campaign_executor = ThreadPoolExecutor(
+    max_workers=app.config.get('CAMPAIGN_WORKERS', 2),
+    thread_name_prefix='campaign'
+)
+
+
+def pack_chemicals(chemicals: List[str],
+                   plate_size: int,
+                   n_points: int,
+                   replicates: int = 1,
+                   controls_per_plate: int = 0) -> List[List[str]]:
+    """
+    Split chemicals into per-plate groups, putting as many curves on each
+    plate as fit while keeping controls_per_plate wells free for controls.
+    """
+    if plate_size not in Plate._size_shape_map:
+        raise InvalidPlateData(f"{plate_size} is not a valid plate size.")
+    if type(controls_per_plate) != int or controls_per_plate < 0:
+        raise InvalidPlateData(
+            f"controls_per_plate must be a non-negative integer, not '{controls_per_plate}'."
+        )
+    per_plate = (plate_size - controls_per_plate) // (n_points * replicates)
+    if per_plate < 1:
+        raise WellOutOfBounds(
+            f"Not even one {n_points} point curve with {replicates} replicates fits on a "
+            f"{plate_size} well plate with {controls_per_plate} control wells."
+        )
+    return [chemicals[i:i + per_plate] for i in range(0, len(chemicals), per_plate)]
+
+
+def start_campaign(name: str, plate_size: int, chemicals: List[str], drc_settings: dict,
+                   controls_per_plate: int = 0) -> Campaign:
+    """
+    Check the settings, work out the plates, create the campaign and its
+    empty plates, then hand every plate to the worker pool to be filled.
+    Returns as soon as the work is queued.
+    """
+    check_drc_settings(chemicals=chemicals, **drc_settings)
+    groups = pack_chemicals(
+        chemicals,
+        plate_size,
+        drc_settings['n_points'],
+        drc_settings.get('replicates', 1),
+        controls_per_plate
+    )
+
+    settings = {'chemicals': chemicals, 'controls_per_plate': controls_per_plate, 'drc_settings': drc_settings}
+    campaign = Campaign(name=name, plate_size=plate_size, n_plates=len(groups), settings=settings)
+    db.session.add(campaign)
+    db.session.flush()
+    if groups:
+        db.session.execute(insert(Plate), [
+            {'name': f"{name}-{i + 1}", 'size': plate_size, 'version': 0, 'campaign_id': campaign.id}
+            for i in range(len(groups))
+        ])
+    else:
+        campaign.status = 'done'
+    db.session.commit()
+
+    plate_ids = db.session.scalars(select(Plate.id).where(Plate.campaign_id == campaign.id).order_by(Plate.id)).all()
+    for plate_id, group in zip(plate_ids, groups):
+        campaign_executor.submit(fill_campaign_plate, campaign.id, plate_id, group, drc_settings)
+    return campaign
+
+
+def fill_campaign_plate(campaign_id: int, plate_id: int, chemicals: List[str], drc_settings: dict) -> None:
+    """
+    worker task: plan and write one plate of a campaign and count it done, in
+    one transaction. a plate that's already been filled, at a version past 0,
+    is left alone, so a plate queued twice is only filled and counted once
+    """
+    with app.app_context():
+        try:
+            # the write lock is taken here, so the version can't change before the commit
+            plate = db.session.get(Plate, plate_id, with_for_update=True, populate_existing=True)
+            if plate.version != 0:
+                db.session.rollback()
+                return
+            plan = plan_dose_response_curves(plate, chemicals=chemicals, **drc_settings)
+            write_dose_response_plan(plate, plan)
+            db.session.execute(
+                update(Campaign).where(Campaign.id == campaign_id).values(plates_done=Campaign.plates_done + 1)
+            )
+            db.session.execute(
+                update(Campaign)
+                .where(Campaign.id == campaign_id, Campaign.status == 'running',
+                       Campaign.plates_done == Campaign.n_plates)
+                .values(status='done')
+            )
+            db.session.commit()
+        except Exception as e:
+            logger.exception("filling plate %s of campaign %s failed", plate_id, campaign_id)
+            db.session.rollback()
+            db.session.execute(
+                update(Campaign).where(Campaign.id == campaign_id).values(status='failed', error=str(e))
+            )
+            db.session.commit()
+
+
+def resume_campaigns() -> int:
+    """
+    Queue the unfilled plates, still at version 0, of every running campaign.
+    The worker pool lives in the process, so its queue is lost when the
+    process stops. Run at startup. A campaign saved without its settings
+    can't be refilled and is marked failed. Returns how many plates were
+    queued.
+    """
+    with app.app_context():
+        if not inspect(db.engine).has_table(Campaign.__tablename__):
+            return 0
+        queued = 0
+        for campaign in db.session.scalars(select(Campaign).where(Campaign.status == 'running')).all():
+            if campaign.settings is None:
+                campaign.status = 'failed'
+                campaign.error = "Interrupted by a restart before its plates were all filled."
+                continue
+            drc_settings = campaign.settings['drc_settings']
+            groups = pack_chemicals(
+                campaign.settings['chemicals'],
+                campaign.plate_size,
+                drc_settings['n_points'],
+                drc_settings.get('replicates', 1),
+                campaign.settings['controls_per_plate']
+            )
+            plates = db.session.execute(
+                select(Plate.id, Plate.version).where(Plate.campaign_id == campaign.id).order_by(Plate.id)
+            ).all()
+            for (plate_id, version), group in zip(plates, groups):
+                if version == 0:
+                    campaign_executor.submit(fill_campaign_plate, campaign.id, plate_id, group, drc_settings)
+                    queued += 1
+        db.session.commit()
+        if queued:
+            logger.info("queued %d unfilled campaign plates", queued)
+        return queued
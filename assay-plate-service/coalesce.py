@@ -0,0 +1,109 @@
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, NamedTuple
+from app import app, db
+from model import Plate
+from bulk import WellSpec, write_wells
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# how long the first write of a group waits for others to join it, and the most writes in one transaction
+WRITE_COALESCE_WINDOW_MS = app.config.get('WRITE_COALESCE_WINDOW_MS', 5)
+WRITE_COALESCE_MAX_OPS = app.config.get('WRITE_COALESCE_MAX_OPS', 256)
+# how long a request waits for its group to be written before giving up
+WRITE_COALESCE_TIMEOUT_S = app.config.get('WRITE_COALESCE_TIMEOUT_S', 30)
+
+
+def coalescing_enabled() -> bool:
+    return app.config.get('WRITE_COALESCING', False)
+
+
+class PendingWrite(NamedTuple):
+    plate_id: int
+    spec: WellSpec
+    future: Future
+
+
+class WriteCoalescer:
+    """
+    Group commit for single well writes. Request threads queue an already
+    validated WellSpec and wait. One writer thread takes everything queued
+    within a short window and writes it as a single transaction, with one
+    write_wells per plate, so concurrent clients share a commit instead of
+    paying for one each. If the group fails, its writes are retried one
+    transaction each so only the writes that really fail report an error.
+    """
+
+    def __init__(self, window_ms: float = 5, max_ops: int = 256):
+        self.window = window_ms / 1000
+        self.max_ops = max_ops
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, plate_id: int, spec: WellSpec) -> Future:
+        """queue a write. the future resolves once it's committed, or holds its exception"""
+        self._start()
+        future = Future()
+        self._queue.put(PendingWrite(plate_id, spec, future))
+        return future
+
+    def _start(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name='write-coalescer', daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            group = [self._queue.get()]
+            deadline = time.perf_counter() + self.window
+            while len(group) < self.max_ops:
+                remaining = deadline - time.perf_counter()
+                try:
+                    group.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            with app.app_context():
+                self.flush(group)
+
+    def flush(self, group: List[PendingWrite]) -> None:
+        # writes whose requests gave up waiting were cancelled and are skipped.
+        # the rest can no longer be cancelled
+        group = [pending for pending in group if pending.future.set_running_or_notify_cancel()]
+        if not group:
+            return
+        try:
+            self.write(group)
+        except Exception as e:
+            db.session.rollback()
+            if len(group) == 1:
+                group[0].future.set_exception(e)
+            else:
+                logger.warning("group of %d well writes failed, retrying them one at a time", len(group))
+                for pending in group:
+                    try:
+                        self.write([pending])
+                    except Exception as e:
+                        db.session.rollback()
+                        pending.future.set_exception(e)
+
+    @timed('coalesced_write')
+    def write(self, group: List[PendingWrite]) -> None:
+        """one transaction for the whole group. a later write to a well replaces an earlier one, as if run in order"""
+        by_plate: Dict[int, Dict[int, WellSpec]] = {}
+        for pending in group:
+            by_plate.setdefault(pending.plate_id, {})[pending.spec.index] = pending.spec
+        for plate_id, specs in by_plate.items():
+            write_wells(db.session.get(Plate, plate_id), list(specs.values()))
+        db.session.commit()
+        for pending in group:
+            pending.future.set_result(pending.spec)
+
+
+well_write_coalescer = WriteCoalescer(WRITE_COALESCE_WINDOW_MS, WRITE_COALESCE_MAX_OPS)
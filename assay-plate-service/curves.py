@@ -0,0 +1,113 @@
+from typing import Optional, Union, Sequence
+import numpy as np
+from exceptions import InvalidWellContents, InvalidPlateData, WellOutOfBounds
+
+SPACINGS = ('linear', 'log', 'serial')
+ORIENTATIONS = ('horizontal', 'vertical')
+
+ArrayLike = Union[np.ndarray, Sequence[float], float]
+
+
+def dilution_series(max_concentration: ArrayLike,
+                    min_concentration: Optional[ArrayLike],
+                    n_points: int,
+                    spacing: str = 'linear',
+                    dilution_factor: Optional[ArrayLike] = None) -> np.ndarray:
+    """
+    Concentrations for any number of curves at once, highest first. Returns
+    an array of shape (n_curves, n_points), or (n_points,) for scalar inputs.
+
+     - linear: evenly spaced steps from max down to min
+     - log: evenly spaced in log space from max down to min
+     - serial: each point is the one before divided by dilution_factor,
+       starting at max. min is ignored.
+    """
+    if spacing not in SPACINGS:
+        raise InvalidPlateData(
+            f"{spacing} is not a valid spacing. must be one of {', '.join(SPACINGS)}"
+        )
+    if type(n_points) != int or n_points < 2:
+        raise InvalidPlateData(
+            f"n_points must be an integer of at least 2, not '{n_points}'."
+        )
+    scalar = np.ndim(max_concentration) == 0
+    top = np.atleast_1d(np.asarray(max_concentration, dtype=float))[:, None]
+    steps = np.arange(n_points)[None, :]
+    if (top < 0).any():
+        raise InvalidWellContents(f"Specified concentrations may not be negative.")
+
+    if spacing == 'serial':
+        if dilution_factor is None:
+            raise InvalidPlateData(f"A serial dilution needs a dilution_factor.")
+        factor = np.atleast_1d(np.asarray(dilution_factor, dtype=float))[:, None]
+        if (factor <= 1).any():
+            raise InvalidPlateData(f"dilution_factor must be greater than 1.")
+        series = top / factor ** steps
+    else:
+        if min_concentration is None:
+            raise InvalidPlateData(f"A {spacing} curve needs a min_concentration.")
+        bottom = np.atleast_1d(np.asarray(min_concentration, dtype=float))[:, None]
+        if (bottom < 0).any():
+            raise InvalidWellContents(f"Specified concentrations may not be negative.")
+        if (bottom >= top).any():
+            raise InvalidWellContents(
+                f"Invalid curve concentrations. The max concentration must be greater than the min concentration."
+            )
+        if spacing == 'linear':
+            series = top - steps * (top - bottom) / (n_points - 1)
+        else:
+            if (bottom <= 0).any():
+                raise InvalidWellContents(f"A log spaced curve needs a min concentration greater than 0.")
+            series = top * (bottom / top) ** (steps / (n_points - 1))
+    return series[0] if scalar else series
+
+
+def curve_well_indices(starting_well_indices: Union[np.ndarray, Sequence[int], int],
+                       n_points: int,
+                       num_rows: int,
+                       num_cols: int,
+                       orientation: str = 'horizontal') -> np.ndarray:
+    """
+    Well indices covered by any number of curves at once, in the same shape
+    as dilution_series. Horizontal curves run along a row and wrap onto the
+    next one. Vertical curves run down a column and wrap onto the next one.
+    """
+    if orientation not in ORIENTATIONS:
+        raise InvalidPlateData(
+            f"{orientation} is not a valid orientation. must be 'horizontal' or 'vertical'"
+        )
+    scalar = np.ndim(starting_well_indices) == 0
+    starts = np.atleast_1d(np.asarray(starting_well_indices, dtype=np.int64))[:, None]
+    steps = np.arange(n_points)[None, :]
+    size = num_rows * num_cols
+
+    if orientation == 'horizontal':
+        indices = starts + steps
+    else:
+        # walk the plate in column-major order
+        start_rows, start_cols = np.divmod(starts, num_cols)
+        positions = start_cols * num_rows + start_rows + steps
+        cols, rows = np.divmod(positions, num_rows)
+        indices = np.where(positions < size, rows * num_cols + cols, size)
+
+    if (starts < 0).any() or (indices >= size).any():
+        raise WellOutOfBounds(
+            f"This dose response curve runs off the plate."
+        )
+    return indices[0] if scalar else indices
+
+
+def packed_starting_indices(n_curves: int,
+                            n_points: int,
+                            num_rows: int,
+                            num_cols: int,
+                            orientation: str = 'horizontal') -> np.ndarray:
+    """
+    Starting wells for n_curves laid back to back from A1, along rows for
+    horizontal curves or down columns for vertical ones.
+    """
+    positions = np.arange(n_curves, dtype=np.int64) * n_points
+    if orientation == 'vertical':
+        cols, rows = np.divmod(positions, num_rows)
+        return rows * num_cols + cols
+    return positions
@@ -0,0 +1,157 @@
+from contextlib import contextmanager
+from typing import Iterator
+from flask import Flask, request, g, has_request_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+
+DEFAULT_DATABASE_URI = "sqlite:///assay-plate-service.db"
+# the bind key GET requests read through when ASSAY_READ_DATABASE_URI is set
+READ_BIND = 'read'
+
+
+def is_memory_sqlite(uri: str) -> bool:
+    url = make_url(uri)
+    return url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:')
+
+
+def engine_options(app: Flask, uri: str) -> dict:
+    """pool settings for one engine. in memory SQLite is left on the single connection Flask-SQLAlchemy gives it"""
+    if is_memory_sqlite(uri):
+        return {}
+    options = {
+        'pool_size': app.config.get('DB_POOL_SIZE', 5),
+        'max_overflow': app.config.get('DB_MAX_OVERFLOW', 10),
+        'pool_timeout': app.config.get('DB_POOL_TIMEOUT', 30),
+        'pool_recycle': app.config.get('DB_POOL_RECYCLE', 1800),
+        'pool_pre_ping': make_url(uri).get_backend_name() != 'sqlite',
+    }
+    statement_timeout = app.config.get('DB_STATEMENT_TIMEOUT_MS')
+    if statement_timeout and make_url(uri).get_backend_name() == 'postgresql':
+        options['connect_args'] = {'options': f'-c statement_timeout={int(statement_timeout)}'}
+    return options
+
+
+def configure_database(app: Flask, uri: str, read_uri: str = None) -> None:
+    """
+    Set up the engine config before Flask-SQLAlchemy is initialised: the
+    primary database, pool sizes and timeouts, and a second engine for reads
+    when read_uri is given.
+    """
+    app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_DATABASE_URI"] = uri
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(app, uri)
+    if read_uri:
+        app.config["SQLALCHEMY_BINDS"] = {READ_BIND: {'url': read_uri, **engine_options(app, read_uri)}}
+
+
+def sqlite_pragmas(app: Flask) -> dict:
+    """
+    WAL lets readers carry on while a writer commits, and NORMAL
+    synchronous is still safe with it. busy_timeout makes a writer wait for
+    the lock instead of failing straight away.
+    """
+    return {
+        'journal_mode': app.config.get('SQLITE_JOURNAL_MODE', 'WAL'),
+        'synchronous': app.config.get('SQLITE_SYNCHRONOUS', 'NORMAL'),
+        'busy_timeout': app.config.get('SQLITE_BUSY_TIMEOUT_MS', 30000),
+        # negative means KiB rather than pages
+        'cache_size': -app.config.get('SQLITE_CACHE_SIZE_KB', 64 * 1024),
+        'mmap_size': app.config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'temp_store': 'MEMORY',
+    }
+
+
+def reads_only() -> None:
+    """declare that the current request only reads through its own session, so its transactions needn't lock"""
+    g.reads_only = True
+
+
+def commits_repeatedly() -> None:
+    """declare that the current request writes in several transactions, so each of them takes the write lock"""
+    g.commits_repeatedly = True
+
+
+@contextmanager
+def reading() -> Iterator[None]:
+    """
+    start any transaction begun inside the block without the write lock, even
+    in a request that commits repeatedly. end it before the block does
+    """
+    previous = g.get('reads_only')
+    g.reads_only = True
+    try:
+        yield
+    finally:
+        g.reads_only = previous
+
+
+class RoutingSession(Session):
+    """
+    Sends the queries of a read only request to the read engine, when there
+    is one. Anything that writes, or runs while the session is flushing,
+    still goes to the primary.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.info.get('read_only') and not self._flushing:
+            read_engine = self._db.engines.get(READ_BIND)
+            if read_engine is not None and not getattr(clause, 'is_dml', False):
+                return read_engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+def init_engines(app: Flask, db) -> None:
+    """apply the SQLite pragmas and transaction handling to every new connection, and mark GET requests read only"""
+    pragmas = sqlite_pragmas(app)
+    with app.app_context():
+        engines = list(db.engines.values())
+
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            if value is not None:
+                cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+    begin_immediate = app.config.get('SQLITE_BEGIN_IMMEDIATE', True)
+
+    def take_over_transactions(dbapi_connection, connection_record):
+        # stop the sqlite3 module issuing its own BEGIN, so begin_transaction decides how they start
+        dbapi_connection.isolation_level = None
+
+    def begin_transaction(conn):
+        # A deferred transaction that reads and then writes fails straight away
+        # with "database is locked" if another writer got in first, busy_timeout
+        # or not. Anything that might write takes the write lock up front instead
+        # and waits its turn. Reads stay deferred so they never wait on writers,
+        # and so does whatever a request reads back after its commit to build the
+        # response, which would otherwise hold the lock until teardown.
+        if has_request_context() and (
+                request.method in ('GET', 'HEAD') or g.get('reads_only')
+                or (g.get('committed') and not g.get('commits_repeatedly'))):
+            conn.exec_driver_sql("BEGIN")
+        else:
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def note_commit(session):
+        if has_request_context():
+            g.committed = True
+
+    for engine in engines:
+        if engine.dialect.name == 'sqlite' and not is_memory_sqlite(str(engine.url)):
+            event.listen(engine, 'connect', apply_pragmas)
+            if begin_immediate:
+                event.listen(engine, 'connect', take_over_transactions)
+                event.listen(engine, 'begin', begin_transaction)
+    if begin_immediate:
+        event.listen(db.session, 'after_commit', note_commit)
+
+    @app.before_request
+    def route_reads():
+        db.session.info['read_only'] = request.method in ('GET', 'HEAD')
+
+    @app.teardown_request
+    def stop_routing_reads(exc):
+        # the session outlives the request when an app context was already pushed
+        db.session.info.pop('read_only', None)
@@ -0,0 +1,170 @@
+import numpy as np
+from typing import List, Optional, NamedTuple
+from sqlalchemy import insert, delete
+from app import db
+from exceptions import WellOutOfBounds, InvalidPlateData, InvalidWellContents, InvalidPayload
+from model import Plate, DoseResponseCurve, check_cell_line, check_chemical_str_id, pair_chemicals, standardize_chemicals
+from layout import PlateLayout
+from curves import dilution_series, curve_well_indices, packed_starting_indices, ORIENTATIONS
+from metrics import timed
+from validation import identifier_errors, concentration_errors
+
+
+class DRCPlan(NamedTuple):
+    """everything needed to lay out a plate of dose response curves, computed before any writes"""
+    # DoseResponseCurve rows, ready to insert
+    curves: List[dict]
+    layout: PlateLayout
+
+
+@timed('validate_drc')
+def check_drc_settings(cell_line: Optional[str],
+                       chemicals: List[str],
+                       min_concentration: Optional[float],
+                       max_concentration: float,
+                       n_points: int,
+                       control_chemical: str,
+                       control_concentration: float,
+                       orientation: str = 'horizontal',
+                       spacing: str = 'linear',
+                       dilution_factor: Optional[float] = None,
+                       replicates: int = 1) -> None:
+    """
+    Check every curve setting, independent of which plate the curves end up
+    on, and raise InvalidPayload listing everything that's wrong rather
+    than just the first problem.
+    """
+    errors = []
+
+    def problem(field: str, error: str) -> None:
+        errors.append({'field': field, 'error': error})
+
+    if type(n_points) != int or n_points < 2:
+        problem('n_points', f"n_points must be an integer of at least 2, not '{n_points}'.")
+    if type(replicates) != int or replicates < 1:
+        problem('replicates', f"replicates must be an integer of at least 1, not '{replicates}'.")
+    if orientation not in ORIENTATIONS:
+        problem('orientation', f"{orientation} is not a valid orientation. must be 'horizontal' or 'vertical'")
+    if cell_line is not None and type(cell_line) != str:
+        problem('cell_line', f"'{cell_line}' is not a valid cell line identifier.")
+    else:
+        for error in identifier_errors([cell_line], check_cell_line).values():
+            problem('cell_line', error)
+    if type(chemicals) != list:
+        problem('chemicals', f"chemicals must be a list of chemical identifiers, not '{chemicals}'.")
+    else:
+        for error in identifier_errors(chemicals, check_chemical_str_id).values():
+            problem('chemicals', error)
+    control_chemicals = [control_chemical] if type(control_chemical) == str else control_chemical
+    if type(control_chemicals) != list:
+        problem('control_chemical', f"'{control_chemical}' is not a valid chemical identifier.")
+    else:
+        for error in identifier_errors(control_chemicals, check_chemical_str_id).values():
+            problem('control_chemical', error)
+    control_concentrations = control_concentration if type(control_concentration) == list else [control_concentration]
+    for error in concentration_errors(control_concentrations).values():
+        problem('control_concentration', error)
+    if type(control_chemicals) == list:
+        try:
+            pair_chemicals(control_chemical, control_concentration)
+        except InvalidWellContents as e:
+            problem('control_concentration', str(e))
+    if type(n_points) == int and n_points >= 2:
+        try:
+            dilution_series(max_concentration, min_concentration, n_points, spacing, dilution_factor)
+        except (InvalidPlateData, InvalidWellContents) as e:
+            problem('concentrations', str(e))
+        except (TypeError, ValueError):
+            problem('concentrations', f"max_concentration, min_concentration and dilution_factor must be numbers.")
+    if errors:
+        raise InvalidPayload(errors)
+
+
+@timed('plan_drc')
+def plan_dose_response_curves(plate: Plate,
+                              cell_line: Optional[str],
+                              chemicals: List[str],
+                              min_concentration: Optional[float],
+                              max_concentration: float,
+                              n_points: int,
+                              control_chemical: str,
+                              control_concentration: float,
+                              orientation: str = 'horizontal',
+                              spacing: str = 'linear',
+                              dilution_factor: Optional[float] = None,
+                              replicates: int = 1
+                              ) -> DRCPlan:
+    """
+    Lay out replicates curves per chemical, back to back from well 0 (along
+    rows for horizontal curves, down columns for vertical ones), then fill
+    every remaining well with the control. Every well on the plate gets the
+    cell line. Curve positions and concentrations are worked out for every
+    curve at once by the curves engine.
+    """
+    check_drc_settings(cell_line, chemicals, min_concentration, max_concentration, n_points,
+                       control_chemical, control_concentration, orientation, spacing, dilution_factor, replicates)
+    n_curves = len(chemicals) * replicates
+    if n_curves * n_points > plate.size:
+        raise WellOutOfBounds(
+            f"Too many wells are needed to fit onto plate {plate.name} alone. "
+            f"Consider reducing the number of chemicals or the number of points in the response curve."
+        )
+    control_chemicals, control_concentrations = standardize_chemicals(control_chemical, control_concentration)
+
+    num_rows, num_cols = plate.shape
+    starts = packed_starting_indices(n_curves, n_points, num_rows, num_cols, orientation)
+    indices = curve_well_indices(starts, n_points, num_rows, num_cols, orientation)
+    concentrations = dilution_series(max_concentration, min_concentration, n_points, spacing, dilution_factor)
+    if min_concentration is None:
+        min_concentration = float(concentrations[-1])
+
+    # the curve parameters were validated once above for every curve, so the
+    # rows are built directly rather than through a DoseResponseCurve apiece
+    curves = []
+    layout = PlateLayout(plate)
+    for i, chemical in enumerate(chemicals):
+        for replicate in range(replicates):
+            curves.append({
+                'plate_id': plate.id,
+                'starting_well_index': int(starts[i * replicates + replicate]),
+                'n_points': n_points,
+                'max_concentration': max_concentration,
+                'min_concentration': min_concentration,
+                'chemical': chemical,
+                'orientation': orientation,
+                'spacing': spacing,
+                'dilution_factor': dilution_factor,
+                'replicate': replicate
+            })
+        chemical_curves = slice(i * replicates, (i + 1) * replicates)
+        layout.assign(indices[chemical_curves].ravel(), cell_line, chemical, np.tile(concentrations, replicates))
+
+    # everything the curves didn't use becomes a control well; a control
+    # chemical given without a concentration keeps None (NaN) on its own
+    layout.assign(~layout.occupied, cell_line, control_chemicals, control_concentrations)
+    return DRCPlan(curves, layout)
+
+
+@timed('apply_drc')
+def apply_dose_response_plan(plate: Plate, plan: DRCPlan) -> int:
+    """write the curves and their wells in one transaction, returning how many wells were written"""
+    try:
+        n_wells = write_dose_response_plan(plate, plan)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return n_wells
+
+
+def write_dose_response_plan(plate: Plate, plan: DRCPlan) -> int:
+    """
+    write the curves and their wells without committing, returning how many
+    wells were written. the plate's earlier curves are replaced, and the new
+    ones go in after the wells so writing the wells doesn't drop them
+    """
+    db.session.execute(delete(DoseResponseCurve).where(DoseResponseCurve.plate_id == plate.id))
+    n_wells = plan.layout.flush(op='drc')
+    if plan.curves:
+        db.session.execute(insert(DoseResponseCurve), plan.curves)
+    return n_wells
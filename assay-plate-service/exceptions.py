@@ -1,3 +1,5 @@
+from typing import List
+from flask import jsonify
 from app import app
 
 
@@ -22,6 +24,21 @@ class InvalidPlateData(Exception):
     description = "Invalid Data submitted"
 
 
+class WriteTimedOut(Exception):
+    code = 503
+    description = "Write timed out"
+
+
+class InvalidPayload(Exception):
+    """every problem found with a request payload, reported together"""
+    code = 400
+    description = "Invalid payload"
+
+    def __init__(self, errors: List[dict]):
+        super().__init__(' '.join(error['error'] for error in errors))
+        self.errors = errors
+
+
 # Error Handlers
 @app.errorhandler(KeyError)
 def bad_request_handler(error):
@@ -48,3 +65,11 @@ def invalid_plate_data_handler(error):
     return f"Invalid Plate Data Error: {error.code} - {str(error)}"
 
 
+@app.errorhandler(WriteTimedOut)
+def write_timed_out_handler(error):
+    return f"Write Timed Out Error: {error.code} - {str(error)}", error.code
+
+
+@app.errorhandler(InvalidPayload)
+def invalid_payload_handler(error):
+    return jsonify({'errors': error.errors}), error.code
@@ -0,0 +1,140 @@
+import io
+import numpy as np
+from sqlalchemy import select
+from app import db
+from exceptions import InvalidPlateData
+from model import Plate, Well
+from layout import PlateLayout
+
+# arrow support is optional
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# format -> mimetype
+EXCHANGE_FORMATS = {
+    'npz': 'application/x-npz',
+    'arrow': 'application/vnd.apache.arrow.file',
+}
+COLUMNS = ('index', 'cell_line', 'chemical', 'concentration')
+
+
+def check_format(fmt: str) -> str:
+    if fmt not in EXCHANGE_FORMATS:
+        raise InvalidPlateData(
+            f"{fmt} is not a supported format. must be one of {', '.join(EXCHANGE_FORMATS)}"
+        )
+    if fmt == 'arrow' and pa is None:
+        raise InvalidPlateData(f"arrow files need pyarrow installed on the server. use npz instead.")
+    return fmt
+
+
+def export_plate(plate: Plate, fmt: str) -> bytes:
+    """
+    The plate's contents as a columnar file, read in one query. Neither
+    format is compressed, so clients can memory map the columns: np.load
+    on the npz members or pyarrow.memory_map on the arrow file.
+
+    Columns are index, cell_line, chemical and concentration with one row
+    per well and chemical (see PlateLayout.columns). cell_line and chemical
+    are codes into cell_line_table and chemical_table, which the npz stores
+    alongside the columns and the arrow file stores as dictionaries.
+    """
+    check_format(fmt)
+    layout = PlateLayout.load(plate)
+    columns = layout.columns()
+    buffer = io.BytesIO()
+
+    if fmt == 'npz':
+        np.savez(
+            buffer,
+            **columns,
+            cell_line_table=np.array(layout.cell_line_table, dtype=str),
+            chemical_table=np.array(layout.chemical_table, dtype=str),
+            plate=np.array([plate.id, plate.size, plate.version], dtype=np.int64)
+        )
+    else:
+        def codes(name, table):
+            return pa.DictionaryArray.from_arrays(
+                pa.array(columns[name], type=pa.int32(), mask=columns[name] < 0),
+                pa.array(table, type=pa.string())
+            )
+        table = pa.table({
+            'index': pa.array(columns['index'], type=pa.int32()),
+            'cell_line': codes('cell_line', layout.cell_line_table),
+            'chemical': codes('chemical', layout.chemical_table),
+            'concentration': pa.array(columns['concentration'], mask=np.isnan(columns['concentration'])),
+        }, metadata={'plate_id': str(plate.id), 'size': str(plate.size), 'version': str(plate.version)})
+        with pa.ipc.new_file(buffer, table.schema) as writer:
+            writer.write_table(table)
+    return buffer.getvalue()
+
+
+def read_columns(data: bytes, fmt: str) -> dict:
+    """
+    Columns, code tables and plate size back out of an exported file. Arrow
+    string columns may be dictionary encoded or plain.
+    """
+    check_format(fmt)
+    try:
+        if fmt == 'npz':
+            with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+                missing = [name for name in COLUMNS + ('cell_line_table', 'chemical_table') if name not in npz]
+                if missing:
+                    raise InvalidPlateData(f"This file is missing {', '.join(missing)}.")
+                columns = {name: npz[name] for name in COLUMNS}
+                columns['cell_line_table'] = npz['cell_line_table'].tolist()
+                columns['chemical_table'] = npz['chemical_table'].tolist()
+                size = int(npz['plate'][1]) if 'plate' in npz else None
+        else:
+            table = pa.ipc.open_file(pa.BufferReader(data)).read_all()
+            missing = [name for name in COLUMNS if name not in table.column_names]
+            if missing:
+                raise InvalidPlateData(f"This file is missing {', '.join(missing)}.")
+            columns = {
+                'index': table['index'].to_numpy(),
+                'concentration': table['concentration'].combine_chunks().fill_null(np.nan).to_numpy(zero_copy_only=False),
+            }
+            for name in ('cell_line', 'chemical'):
+                column = table[name].combine_chunks()
+                if not pa.types.is_dictionary(column.type):
+                    column = column.dictionary_encode()
+                columns[name] = column.indices.fill_null(-1).to_numpy(zero_copy_only=False)
+                columns[f'{name}_table'] = column.dictionary.to_pylist()
+            metadata = table.schema.metadata or {}
+            size = int(metadata[b'size']) if b'size' in metadata else None
+    except InvalidPlateData:
+        raise
+    except Exception as e:
+        raise InvalidPlateData(f"Couldn't read this {fmt} file: {e}")
+    columns['size'] = size
+    return columns
+
+
+def import_plate(plate: Plate, data: bytes, fmt: str, replace: bool = False) -> int:
+    """
+    Write a columnar file onto the plate with write_wells' bulk statements,
+    straight from the arrays. Wells in the file are overwritten. With
+    replace every other stored well is emptied too, so the plate ends up
+    exactly as the file describes it. Nothing is committed. Returns how
+    many wells were written.
+    """
+    columns = read_columns(data, fmt)
+    if columns['size'] is not None and columns['size'] != plate.size:
+        raise InvalidPlateData(
+            f"This file is for a {columns['size']} well plate but plate {plate.id} has {plate.size} wells."
+        )
+    layout = PlateLayout.from_columns(
+        plate,
+        columns['index'],
+        columns['cell_line'],
+        columns['chemical'],
+        columns['concentration'],
+        columns['cell_line_table'],
+        columns['chemical_table']
+    )
+    if replace:
+        stored = db.session.scalars(select(Well.index).where(Well.plate_id == plate.id)).all()
+        layout.clear(np.setdiff1d(np.array(stored, dtype=np.int64), np.flatnonzero(layout.occupied)))
+    return layout.flush(op='import')
@@ -0,0 +1,125 @@
+from typing import NamedTuple
+import numpy as np
+
+# the fewest usable points a 4 parameter curve is fit to
+MIN_FIT_POINTS = 4
+# where a zero concentration is put on the log axis, below the lowest dose
+ZERO_DOSE_DECADES = 3
+
+
+class LogisticFit(NamedTuple):
+    """one value per curve. curves that couldn't be fit are NaN and not converged"""
+    bottom: np.ndarray
+    top: np.ndarray
+    ic50: np.ndarray
+    hill: np.ndarray
+    r_squared: np.ndarray
+    n_points: np.ndarray
+    converged: np.ndarray
+
+
+def logistic(log_x: np.ndarray, params: np.ndarray):
+    """
+    The 4 parameter logistic for every curve and its jacobian with respect to
+    (bottom, top, log_ic50, slope):
+
+        y = bottom + (top - bottom) / (1 + exp(slope * (log x - log_ic50)))
+
+    params has shape (n_curves, 4) and log_x (n_curves, n_points).
+    """
+    bottom, top, log_ic50, slope = (params[:, i:i + 1] for i in range(4))
+    distance = log_x - log_ic50
+    s = 1 / (1 + np.exp(np.clip(slope * distance, -50, 50)))
+    ds = s * (1 - s)
+    y = bottom + (top - bottom) * s
+    jacobian = np.stack([1 - s, s, (top - bottom) * slope * ds, -(top - bottom) * distance * ds], axis=-1)
+    return y, jacobian
+
+
+def sum_of_squares(params: np.ndarray, log_x: np.ndarray, y: np.ndarray, weight: np.ndarray) -> np.ndarray:
+    return (weight * (y - logistic(log_x, params)[0]) ** 2).sum(axis=1)
+
+
+def fit_logistic(concentrations: np.ndarray,
+                 responses: np.ndarray,
+                 max_iterations: int = 200,
+                 tolerance: float = 1e-10) -> LogisticFit:
+    """
+    Fit a 4 parameter logistic to every row of concentrations/responses at
+    once, with Levenberg-Marquardt steps taken for all curves together.
+    Rows can be padded with NaN, which is also how missing responses are
+    left out. The results follow the usual convention: top >= bottom, and
+    hill is negative for curves that fall as the dose goes up.
+    """
+    x = np.atleast_2d(np.asarray(concentrations, dtype=float))
+    y = np.atleast_2d(np.asarray(responses, dtype=float))
+    used = np.isfinite(x) & np.isfinite(y) & (x >= 0)
+    positive = used & (x > 0)
+    n_points = used.sum(axis=1)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        log_x = np.log(np.where(positive, x, 1.0))
+    lowest = np.where(positive, log_x, np.inf).min(axis=1)
+    fittable = (n_points >= MIN_FIT_POINTS) & np.isfinite(lowest)
+    log_x = np.where(positive, log_x, (lowest - ZERO_DOSE_DECADES * np.log(10))[:, None])
+    weight = (used & fittable[:, None]).astype(float)
+    log_x = np.where(weight > 0, log_x, 0.0)
+    y = np.where(weight > 0, y, 0.0)
+
+    # start from the extremes, the dose nearest the midpoint, and a slope of
+    # 1 in whichever direction the data runs
+    rows = np.arange(len(x))
+    bottom = np.where(fittable, np.where(weight > 0, y, np.inf).min(axis=1), 0.0)
+    top = np.where(fittable, np.where(weight > 0, y, -np.inf).max(axis=1), 0.0)
+    nearest_midpoint = np.where(weight > 0, np.abs(y - ((bottom + top) / 2)[:, None]), np.inf).argmin(axis=1)
+    mean_x = (weight * log_x).sum(axis=1) / np.maximum(n_points, 1)
+    mean_y = (weight * y).sum(axis=1) / np.maximum(n_points, 1)
+    trend = (weight * (log_x - mean_x[:, None]) * (y - mean_y[:, None])).sum(axis=1)
+    params = np.stack([bottom, top, log_x[rows, nearest_midpoint], np.where(trend <= 0, 1.0, -1.0)], axis=1)
+    params[~fittable] = 0.0
+
+    sse = sum_of_squares(params, log_x, y, weight)
+    damping = np.full(len(x), 1e-3)
+    converged = ~fittable
+    for _ in range(max_iterations):
+        active = np.flatnonzero(~converged)
+        if not len(active):
+            break
+        fitted, jacobian = logistic(log_x[active], params[active])
+        jacobian *= weight[active][..., None]
+        residuals = weight[active] * (y[active] - fitted)
+        normal = np.einsum('nmi,nmj->nij', jacobian, jacobian)
+        gradient = np.einsum('nmi,nm->ni', jacobian, residuals)
+        diagonal = np.einsum('nii->ni', normal)
+        # a sliver of ridge keeps flat directions (a curve with top == bottom has no ic50) solvable
+        damped = normal + (damping[active][:, None] * diagonal + 1e-12 * (1 + diagonal.max(axis=1, keepdims=True)))[
+            :, :, None] * np.eye(4)
+        trial = params[active] + np.linalg.solve(damped, gradient[..., None])[..., 0]
+
+        # keep steps that lower the error and trust the linearisation more,
+        # otherwise back off towards gradient descent
+        trial_sse = sum_of_squares(trial, log_x[active], y[active], weight[active])
+        better = trial_sse < sse[active]
+        settled = better & (sse[active] - trial_sse <= tolerance * np.maximum(sse[active], tolerance))
+        params[active[better]] = trial[better]
+        sse[active[better]] = trial_sse[better]
+        damping[active] = np.where(better, damping[active] / 10, damping[active] * 10)
+        # a step that can't improve however small it gets means we're at the minimum
+        converged[active[settled | (damping[active] > 1e12)]] = True
+    converged &= fittable
+
+    bottom, top, log_ic50, slope = params.T.copy()
+    # write every curve with top above bottom, and the slope the usual way round
+    flipped = top < bottom
+    bottom[flipped], top[flipped] = top[flipped], bottom[flipped].copy()
+    slope[flipped] = -slope[flipped]
+    hill = -slope
+
+    total = (weight * (y - mean_y[:, None]) ** 2).sum(axis=1)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        r_squared = np.where(total > 0, 1 - sse / total, np.nan)
+        ic50 = np.exp(log_ic50)
+    unfit = ~fittable
+    for values in (bottom, top, ic50, hill, r_squared):
+        values[unfit] = np.nan
+    return LogisticFit(bottom, top, ic50, hill, r_squared, n_points, converged)
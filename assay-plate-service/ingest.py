@@ -0,0 +1,205 @@
+import csv
+import io
+import itertools
+import re
+from typing import IO, Optional, List, Dict, Tuple
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from app import app, db
+from exceptions import InvalidPlateData, InvalidWellContents, WellOutOfBounds
+from model import Plate
+from bulk import WellSpec, parse_well_spec, write_wells
+from database import reading
+from regions import WELL_NAME, row_number
+
+# rows written per transaction
+UPLOAD_CHUNK_SIZE = app.config.get('UPLOAD_CHUNK_SIZE', 1000)
+# rejected rows listed in the report. any more are only counted
+MAX_REPORTED_REJECTIONS = app.config.get('MAX_REPORTED_REJECTIONS', 1000)
+LIST_SEPARATOR = ';'
+# bytes that aren't UTF-8 are decoded to lone surrogates by surrogateescape
+UNDECODABLE = re.compile('[\udc80-\udcff]')
+
+
+def row_entry(row: Dict[str, str], default_plate_id: Optional[int]) -> Tuple[int, dict]:
+    """
+    One plate map row to a plate id and a well entry parse_well_spec
+    understands. Wells are given by 'well' (A1 style), 'index', or 'row' and
+    'col'. Several chemicals in one well are separated with ';' in both
+    'chemical' and 'concentration'.
+    """
+    def value(name):
+        text = (row.get(name) or '').strip()
+        return text or None
+
+    def integer(name):
+        text = value(name)
+        if text is None:
+            return None
+        try:
+            return int(text)
+        except ValueError:
+            raise WellOutOfBounds(f"{name} '{text}' must be an integer.")
+
+    plate_id = integer('plate_id') if value('plate_id') is not None else default_plate_id
+    if plate_id is None:
+        raise InvalidPlateData(f"Every row needs a plate_id, or pass one as ?plate_id=.")
+
+    entry = {'cell_line': value('cell_line')}
+    well = value('well')
+    if well is not None:
+        match = WELL_NAME.match(well)
+        if not match:
+            raise WellOutOfBounds(f"'{well}' is not a well name like 'B3'.")
+        entry['row'], entry['col'] = row_number(match.group(1)), int(match.group(2)) - 1
+    elif value('index') is not None:
+        entry['index'] = integer('index')
+    else:
+        entry['row'], entry['col'] = integer('row'), integer('col')
+        if entry['row'] is None or entry['col'] is None:
+            raise WellOutOfBounds(f"Every row needs a well, an index, or a row and col.")
+
+    chemicals = value('chemical')
+    if chemicals is not None:
+        chemicals = [str_id.strip() for str_id in chemicals.split(LIST_SEPARATOR)]
+        entry['chemical'] = chemicals if len(chemicals) > 1 else chemicals[0]
+    concentrations = value('concentration')
+    if concentrations is not None:
+        try:
+            concentrations = [float(conc) for conc in concentrations.split(LIST_SEPARATOR)]
+        except ValueError:
+            raise InvalidWellContents(f"Concentration '{concentrations}' must be a number or ';' separated numbers.")
+        entry['concentration'] = concentrations if len(concentrations) > 1 else concentrations[0]
+    return plate_id, entry
+
+
+def row_text(row: Dict[str, str]) -> List[str]:
+    """every value in a csv row, including any past the last header column"""
+    values = []
+    for value in row.values():
+        if isinstance(value, list):
+            values.extend(value)
+        elif value is not None:
+            values.append(value)
+    return values
+
+
+def find_plate(plate_id: int) -> Optional[Plate]:
+    """
+    A detached copy of the plate with just its id, name and size, read in a
+    transaction that ends straight away. Rows are checked against the copy,
+    which never goes back to the database, so no lock is held while the rest
+    of a chunk streams in from the client.
+    """
+    with reading():
+        row = db.session.execute(select(Plate.id, Plate.name, Plate.size).where(Plate.id == plate_id)).first()
+        db.session.commit()
+    if row is None:
+        return None
+    plate = Plate(row.name, row.size)
+    plate.id = row.id
+    return plate
+
+
+class UploadReport:
+    """running totals for one upload, returned to the client at the end"""
+
+    def __init__(self):
+        self.rows = 0
+        self.ingested = 0
+        self.rejected = 0
+        self.chunks = 0
+        self.plate_ids = set()
+        self.errors: List[dict] = []
+
+    def reject(self, line: int, error: str) -> None:
+        self.rejected += 1
+        if len(self.errors) < MAX_REPORTED_REJECTIONS:
+            self.errors.append({'line': line, 'error': error})
+
+    def to_dict(self) -> dict:
+        return {
+            'rows': self.rows,
+            'ingested': self.ingested,
+            'rejected': self.rejected,
+            'chunks': self.chunks,
+            'plate_ids': sorted(self.plate_ids),
+            'errors': self.errors,
+            'errors_truncated': self.rejected > len(self.errors)
+        }
+
+
+def ingest_plate_map(stream: IO[bytes],
+                     default_plate_id: Optional[int] = None,
+                     delimiter: Optional[str] = None,
+                     chunk_size: int = UPLOAD_CHUNK_SIZE) -> UploadReport:
+    """
+    Read a CSV or TSV plate map with a header row off stream and write it
+    UPLOAD_CHUNK_SIZE rows per transaction, so memory stays flat however big
+    the file is. Each row is checked with the same rules as a single well
+    POST. Bad rows are rejected and reported without stopping the upload.
+    Within a chunk a later row for the same well replaces an earlier one,
+    and later chunks overwrite earlier ones, just like posting the rows in
+    order. When no delimiter is given it's a tab if the header has one.
+    """
+    # bad bytes are let through and the rows holding them rejected, rather than
+    # the decode error ending the upload wherever it happens to be
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='surrogateescape', newline='')
+    header = text.readline()
+    if not header.strip():
+        raise InvalidPlateData(f"The plate map is empty. It needs a header row.")
+    if UNDECODABLE.search(header):
+        raise InvalidPlateData(f"The plate map's header row isn't valid UTF-8 text.")
+    if delimiter is None:
+        delimiter = '\t' if '\t' in header else ','
+    reader = csv.DictReader(itertools.chain([header], text), delimiter=delimiter)
+    reader.fieldnames = [name.strip().lower() for name in reader.fieldnames]
+
+    report = UploadReport()
+    plates: Dict[int, Optional[Plate]] = {}
+    chunk = []
+    for row in reader:
+        report.rows += 1
+        line = reader.line_num
+        try:
+            if any(UNDECODABLE.search(value) for value in row_text(row)):
+                raise InvalidPlateData(f"This row isn't valid UTF-8 text.")
+            plate_id, entry = row_entry(row, default_plate_id)
+            if plate_id not in plates:
+                plates[plate_id] = find_plate(plate_id)
+            plate = plates[plate_id]
+            if plate is None:
+                raise InvalidPlateData(f"Plate {plate_id} doesn't exist yet!")
+            chunk.append((line, plate, parse_well_spec(plate, entry)))
+        except KeyError as e:
+            report.reject(line, f"Missing required field: {e}")
+        except (InvalidPlateData, InvalidWellContents, WellOutOfBounds) as e:
+            report.reject(line, str(e))
+        if len(chunk) >= chunk_size:
+            write_chunk(chunk, report)
+            chunk = []
+    if chunk:
+        write_chunk(chunk, report)
+    return report
+
+
+def write_chunk(chunk: List[tuple], report: UploadReport) -> None:
+    """
+    write one chunk of validated rows, grouped by plate, in a single
+    transaction. this is the only place an upload takes the write lock
+    """
+    by_plate: Dict[int, Dict[int, WellSpec]] = {}
+    for line, plate, spec in chunk:
+        by_plate.setdefault(plate.id, {})[spec.index] = spec
+    try:
+        for plate_id, specs in by_plate.items():
+            write_wells(db.session.get(Plate, plate_id), list(specs.values()), op='upload')
+        db.session.commit()
+    except SQLAlchemyError as e:
+        db.session.rollback()
+        for line, plate, spec in chunk:
+            report.reject(line, f"Couldn't be written: {e.__class__.__name__}")
+        return
+    report.chunks += 1
+    report.ingested += len(chunk)
+    report.plate_ids.update(by_plate)
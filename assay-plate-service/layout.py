@@ -0,0 +1,326 @@
+from typing import List, Optional, Union, Tuple, Sequence, Dict
+import numpy as np
+from sqlalchemy import select
+from app import db
+from exceptions import WellOutOfBounds, InvalidWellContents
+from model import Plate, Well, ChemicalInWell, check_cell_line, check_chemical_str_id
+from bulk import WellSpec, write_wells
+
+# anything that can pick out wells on a layout: a boolean mask over the
+# plate, an array of well indices, or a single index
+WellSelector = Union[np.ndarray, Sequence[int], int]
+
+
+def integer_column(name: str, values) -> np.ndarray:
+    """values as int64, refusing anything that isn't already integers rather than truncating it"""
+    values = np.asarray(values)
+    if len(values) and not np.issubdtype(values.dtype, np.integer):
+        raise InvalidWellContents(f"{name} must be a column of integers, not {values.dtype}.")
+    return values.astype(np.int64)
+
+
+class PlateLayout:
+    """
+    Dense, array backed picture of one plate's contents, so whole-plate
+    operations can be done with numpy instead of one ORM well at a time.
+
+    Per well index the layout holds:
+     - occupied: whether the well has anything in it
+     - cell_lines: code into cell_line_table, -1 for no cell line
+     - chemicals: (size, width) codes into chemical_table, -1 for an empty slot
+     - concentrations: (size, width) concentrations, nan where there is none
+
+    width grows as needed for multi-chemical wells. Wells touched since the
+    layout was loaded are tracked in dirty so flush only writes what changed.
+    """
+
+    def __init__(self, plate: Plate, width: int = 1):
+        self.plate = plate
+        self.size = plate.size
+        self.num_rows, self.num_cols = plate.shape
+        self.occupied = np.zeros(self.size, dtype=bool)
+        self.dirty = np.zeros(self.size, dtype=bool)
+        self.cell_lines = np.full(self.size, -1, dtype=np.int32)
+        self.chemicals = np.full((self.size, width), -1, dtype=np.int32)
+        self.concentrations = np.full((self.size, width), np.nan)
+        self.cell_line_table: List[str] = []
+        self.chemical_table: List[str] = []
+        self._cell_line_codes = {}
+        self._chemical_codes = {}
+
+    @classmethod
+    def load(cls, plate: Plate) -> 'PlateLayout':
+        """read every well and chemical on the plate in a single query"""
+        layout = cls(plate)
+        rows = db.session.execute(
+            select(Well.index, Well.cell_line, ChemicalInWell.chemical_str_id, ChemicalInWell.concentration)
+            .outerjoin(ChemicalInWell, ChemicalInWell.well_id == Well.id)
+            .where(Well.plate_id == plate.id)
+            .order_by(Well.index)
+        ).all()
+        slots = np.zeros(layout.size, dtype=np.int32)
+        for index, cell_line, chemical_str_id, concentration in rows:
+            layout.occupied[index] = True
+            layout.cell_lines[index] = layout.cell_line_code(cell_line)
+            if chemical_str_id is not None:
+                slot = slots[index]
+                layout._ensure_width(slot + 1)
+                layout.chemicals[index, slot] = layout.chemical_code(chemical_str_id)
+                layout.concentrations[index, slot] = np.nan if concentration is None else concentration
+                slots[index] += 1
+        return layout
+
+    @classmethod
+    def from_columns(cls,
+                     plate: Plate,
+                     index: np.ndarray,
+                     cell_line: np.ndarray,
+                     chemical: np.ndarray,
+                     concentration: np.ndarray,
+                     cell_line_table: Sequence[str],
+                     chemical_table: Sequence[str]) -> 'PlateLayout':
+        """
+        Build a layout from the long columnar form produced by columns. Every
+        well mentioned is marked dirty, so flush writes exactly those wells.
+        """
+        index = integer_column('index', index)
+        cell_line = integer_column('cell_line', cell_line)
+        chemical = integer_column('chemical', chemical)
+        concentration = np.asarray(concentration, dtype=float)
+        n = len(index)
+        if not len(cell_line) == len(chemical) == len(concentration) == n:
+            raise InvalidWellContents(f"index, cell_line, chemical and concentration must all be the same length.")
+        for name, codes, table in (('cell_line', cell_line, cell_line_table), ('chemical', chemical, chemical_table)):
+            if ((codes < -1) | (codes >= len(table))).any():
+                raise InvalidWellContents(f"{name} codes must be -1 or point into the {name} table.")
+        # NaN is a chemical without a concentration, but infinities are as bad here as anywhere
+        if np.isinf(concentration).any():
+            raise InvalidWellContents(f"Concentrations must be finite numbers.")
+        if (concentration < 0).any():
+            raise InvalidWellContents(f"Concentrations must be positively signed.")
+
+        layout = cls(plate)
+        indices = layout.check_indices(index)
+        for str_id in chemical_table:
+            check_chemical_str_id(str_id)
+        for name in cell_line_table:
+            check_cell_line(name)
+        # the file's codes onto ours, with -1 staying -1
+        cell_line_codes = np.array([layout.cell_line_code(name) for name in cell_line_table] + [-1], dtype=np.int32)
+        chemical_codes = np.array([layout.chemical_code(str_id) for str_id in chemical_table] + [-1], dtype=np.int32)
+
+        layout.occupied[indices] = True
+        layout.dirty[indices] = True
+        layout.cell_lines[indices] = cell_line_codes[cell_line]
+
+        # give each chemical row the next free slot of its well
+        has_chemical = chemical >= 0
+        chemical_indices = indices[has_chemical]
+        order = np.argsort(chemical_indices, kind='stable')
+        sorted_indices = chemical_indices[order]
+        group_starts = np.flatnonzero(np.r_[True, sorted_indices[1:] != sorted_indices[:-1]])
+        group_sizes = np.diff(np.r_[group_starts, len(sorted_indices)])
+        slots = np.arange(len(sorted_indices)) - np.repeat(group_starts, group_sizes)
+        codes = chemical_codes[chemical[has_chemical][order]]
+        if len(codes):
+            pairs = sorted_indices * len(layout.chemical_table) + codes
+            if len(np.unique(pairs)) != len(pairs):
+                raise InvalidWellContents(f"A chemical can only appear once per well.")
+            layout._ensure_width(int(slots.max()) + 1)
+            layout.chemicals[sorted_indices, slots] = codes
+            layout.concentrations[sorted_indices, slots] = concentration[has_chemical][order]
+        return layout
+
+    # Codes
+    def cell_line_code(self, cell_line: Optional[str]) -> int:
+        if cell_line is None:
+            return -1
+        if cell_line not in self._cell_line_codes:
+            self._cell_line_codes[cell_line] = len(self.cell_line_table)
+            self.cell_line_table.append(cell_line)
+        return self._cell_line_codes[cell_line]
+
+    def chemical_code(self, str_id: str) -> int:
+        if str_id not in self._chemical_codes:
+            self._chemical_codes[str_id] = len(self.chemical_table)
+            self.chemical_table.append(str_id)
+        return self._chemical_codes[str_id]
+
+    def _ensure_width(self, width: int) -> None:
+        extra = width - self.chemicals.shape[1]
+        if extra > 0:
+            self.chemicals = np.pad(self.chemicals, ((0, 0), (0, extra)), constant_values=-1)
+            self.concentrations = np.pad(self.concentrations, ((0, 0), (0, extra)), constant_values=np.nan)
+
+    # Addressing
+    def index(self, rows: Union[np.ndarray, Sequence[int]], cols: Union[np.ndarray, Sequence[int]]) -> np.ndarray:
+        """vectorized Plate.get_index: row/col arrays to well indices"""
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        bad = (rows < 0) | (rows >= self.num_rows) | (cols < 0) | (cols >= self.num_cols)
+        if bad.any():
+            raise WellOutOfBounds(
+                f"Invalid well positions for this plate type: "
+                f"{list(zip(rows[bad].tolist(), cols[bad].tolist()))}. This plate has "
+                f"{self.num_rows} rows and {self.num_cols} columns."
+            )
+        return rows * self.num_cols + cols
+
+    def row_col(self, indices: Union[np.ndarray, Sequence[int]]) -> Tuple[np.ndarray, np.ndarray]:
+        """well indices back to (rows, cols) arrays"""
+        indices = self.check_indices(indices)
+        return np.divmod(indices, self.num_cols)
+
+    def check_indices(self, indices: Union[np.ndarray, Sequence[int]]) -> np.ndarray:
+        indices = np.asarray(indices, dtype=np.int64)
+        bad = (indices < 0) | (indices >= self.size)
+        if bad.any():
+            raise WellOutOfBounds(
+                f"Invalid well indices for this plate type: {indices[bad].tolist()}. Well "
+                f"indices must be integers from 0 to {self.size - 1}."
+            )
+        return indices
+
+    def region(self,
+               rows: Optional[Tuple[int, int]] = None,
+               cols: Optional[Tuple[int, int]] = None) -> np.ndarray:
+        """
+        Boolean mask over the plate for a rectangle of wells. rows and cols are
+        inclusive (first, last) pairs, and leaving one out selects all of them.
+        """
+        first_row, last_row = rows if rows is not None else (0, self.num_rows - 1)
+        first_col, last_col = cols if cols is not None else (0, self.num_cols - 1)
+        self.index([first_row, last_row], [first_col, last_col])
+        well_rows, well_cols = np.divmod(np.arange(self.size), self.num_cols)
+        return ((well_rows >= first_row) & (well_rows <= last_row) &
+                (well_cols >= first_col) & (well_cols <= last_col))
+
+    def _selected(self, wells: WellSelector) -> np.ndarray:
+        """turn any WellSelector into an array of well indices"""
+        wells = np.asarray(wells)
+        if wells.dtype == bool:
+            if wells.shape != (self.size,):
+                raise WellOutOfBounds(f"A well mask must have one entry per well ({self.size}).")
+            return np.flatnonzero(wells)
+        return self.check_indices(np.atleast_1d(wells))
+
+    # Bulk edits
+    def assign(self,
+               wells: WellSelector,
+               cell_line: Optional[str] = None,
+               chemicals: Optional[Union[List[str], str]] = None,
+               concentrations: Optional[Union[np.ndarray, Sequence[float], float]] = None,
+               keep_cell_line: bool = False) -> None:
+        """
+        Overwrite the selected wells. chemicals is one chemical or a list of
+        chemicals put in every selected well. concentrations broadcasts
+        against (n_wells, n_chemicals), so a scalar, one value per chemical, or
+        one value per well (as a column) all work.
+        """
+        indices = self._selected(wells)
+        if chemicals is None:
+            chemicals = []
+        elif type(chemicals) == str:
+            chemicals = [chemicals]
+        for str_id in chemicals:
+            check_chemical_str_id(str_id)
+        n_chemicals = len(chemicals)
+
+        if concentrations is None:
+            concentrations = np.full((len(indices), n_chemicals), np.nan)
+        else:
+            concentrations = np.asarray(concentrations, dtype=float)
+            if concentrations.ndim == 1 and len(concentrations) == len(indices) and n_chemicals == 1:
+                concentrations = concentrations[:, None]
+            try:
+                concentrations = np.broadcast_to(concentrations, (len(indices), n_chemicals))
+            except ValueError:
+                raise InvalidWellContents(
+                    f"Concentrations of shape {concentrations.shape} don't fit "
+                    f"{len(indices)} wells with {n_chemicals} chemicals each."
+                )
+            if (concentrations < 0).any():
+                raise InvalidWellContents(
+                    f"Concentrations must be positively signed."
+                )
+
+        self._ensure_width(max(n_chemicals, 1))
+        if not keep_cell_line:
+            check_cell_line(cell_line)
+            self.cell_lines[indices] = self.cell_line_code(cell_line)
+        self.chemicals[indices] = -1
+        self.concentrations[indices] = np.nan
+        if n_chemicals:
+            codes = np.array([self.chemical_code(str_id) for str_id in chemicals], dtype=np.int32)
+            self.chemicals[indices, :n_chemicals] = codes
+            self.concentrations[indices, :n_chemicals] = concentrations
+        self.occupied[indices] = True
+        self.dirty[indices] = True
+
+    def set_cell_line(self, wells: WellSelector, cell_line: Optional[str]) -> None:
+        """change only the cell line of the selected wells"""
+        check_cell_line(cell_line)
+        indices = self._selected(wells)
+        self.cell_lines[indices] = self.cell_line_code(cell_line)
+        self.occupied[indices] = True
+        self.dirty[indices] = True
+
+    def clear(self, wells: WellSelector) -> None:
+        indices = self._selected(wells)
+        self.cell_lines[indices] = -1
+        self.chemicals[indices] = -1
+        self.concentrations[indices] = np.nan
+        self.occupied[indices] = False
+        self.dirty[indices] = True
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        """
+        The occupied wells in long columnar form, one row per well and
+        chemical, ordered by well index: index, cell_line (code into
+        cell_line_table, -1 for none), chemical (code into chemical_table, -1
+        for none) and concentration (nan for none). A well with no chemicals
+        still gets one row so its cell line isn't lost.
+        """
+        wells = np.flatnonzero(self.occupied)
+        chemicals = self.chemicals[wells]
+        keep = chemicals >= 0
+        keep[:, 0] |= ~keep.any(axis=1)
+        rows, slots = np.nonzero(keep)
+        return {
+            'index': wells[rows].astype(np.int32),
+            'cell_line': self.cell_lines[wells[rows]],
+            'chemical': chemicals[rows, slots],
+            'concentration': self.concentrations[wells[rows], slots],
+        }
+
+    # Back to the db
+    def specs(self, wells: Optional[WellSelector] = None) -> List[WellSpec]:
+        """WellSpecs for the selected wells, or for every dirty well by default"""
+        indices = np.flatnonzero(self.dirty) if wells is None else self._selected(wells)
+        # pull the selected rows out as plain lists once rather than poking numpy per well
+        cell_line_table = self.cell_line_table + [None]
+        chemical_table = self.chemical_table
+        cell_lines = self.cell_lines[indices].tolist()
+        chemicals = self.chemicals[indices].tolist()
+        concentrations = np.where(np.isnan(self.concentrations[indices]), None, self.concentrations[indices]).tolist()
+        specs = []
+        for i, index in enumerate(indices.tolist()):
+            slots = [slot for slot, code in enumerate(chemicals[i]) if code >= 0]
+            specs.append(WellSpec(
+                index,
+                cell_line_table[cell_lines[i]],
+                [chemical_table[chemicals[i][slot]] for slot in slots],
+                [concentrations[i][slot] for slot in slots]
+            ))
+        return specs
+
+    def flush(self, op: str = 'set') -> int:
+        """
+        Write every dirty well with write_wells' bulk statements. Nothing is
+        committed, so the caller owns the transaction. Returns how many wells
+        were written.
+        """
+        specs = self.specs()
+        write_wells(self.plate, specs, op=op)
+        self.dirty[:] = False
+        return len(specs)
@@ -0,0 +1,222 @@
+import logging
+import threading
+import time
+from bisect import bisect_left
+from functools import wraps
+from typing import Dict, Tuple, List
+from flask import g, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import app, db
+
+logger = logging.getLogger(__name__)
+
+# the StatementCounters open on each thread, innermost last
+_open_counters = threading.local()
+
+
+def _counters() -> List['StatementCounter']:
+    counters = getattr(_open_counters, 'stack', None)
+    if counters is None:
+        counters = _open_counters.stack = []
+    return counters
+
+
+class StatementCounter:
+    """
+    counts the SQL statements and commits issued by the current thread while
+    the context is open, and the time spent in them. Counters nest, and every
+    open one sees each statement.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.commits = 0
+        self.sql_elapsed = 0.0
+        self.elapsed = 0.0
+        self._started = None
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        _counters().append(self)
+        return self
+
+    def __exit__(self, *exc):
+        _counters().remove(self)
+        self.elapsed = time.perf_counter() - self._started
+        return False
+
+
+# one set of listeners for everything, which do nothing unless a counter is open
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    counters = _counters()
+    if counters:
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+        for counter in counters:
+            counter.count += 1
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _time_statement(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.get('statement_started')
+    if started:
+        elapsed = time.perf_counter() - started.pop()
+        for counter in _counters():
+            counter.sql_elapsed += elapsed
+
+
+@event.listens_for(db.session, 'after_commit')
+def _count_commit(session):
+    for counter in _counters():
+        counter.commits += 1
+
+
+class Histogram:
+    """cumulative bucket counts plus sum and count, the way prometheus wants them"""
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self, name: str, labels: str):
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield f'{name}_bucket{{{labels},le="{le}"}} {cumulative}'
+        yield f'{name}_sum{{{labels}}} {self.sum!r}'
+        yield f'{name}_count{{{labels}}} {self.count}'
+
+
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+
+class Metrics:
+    """per endpoint request timings and SQL counts, and timings of named sections of code"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.request_seconds: Dict[Tuple[str, str, int], Histogram] = {}
+        self.request_statements: Dict[Tuple[str, str], Histogram] = {}
+        self.request_sql_seconds: Dict[Tuple[str, str], float] = {}
+        self.request_commits: Dict[Tuple[str, str], int] = {}
+        self.slow_requests: Dict[Tuple[str, str], int] = {}
+        self.section_seconds: Dict[str, Histogram] = {}
+
+    def observe_request(self, endpoint: str, method: str, status: int, counter: StatementCounter, slow: bool) -> None:
+        with self._lock:
+            key = (endpoint, method)
+            self.request_seconds.setdefault(key + (status,), Histogram(SECONDS_BUCKETS)).observe(counter.elapsed)
+            self.request_statements.setdefault(key, Histogram(STATEMENT_BUCKETS)).observe(counter.count)
+            self.request_sql_seconds[key] = self.request_sql_seconds.get(key, 0.0) + counter.sql_elapsed
+            self.request_commits[key] = self.request_commits.get(key, 0) + counter.commits
+            if slow:
+                self.slow_requests[key] = self.slow_requests.get(key, 0) + 1
+
+    def observe_section(self, name: str, seconds: float) -> None:
+        with self._lock:
+            self.section_seconds.setdefault(name, Histogram(SECONDS_BUCKETS)).observe(seconds)
+
+    def clear(self) -> None:
+        with self._lock:
+            for observed in (self.request_seconds, self.request_statements, self.request_sql_seconds,
+                             self.request_commits, self.slow_requests, self.section_seconds):
+                observed.clear()
+
+    def render(self) -> str:
+        """everything in the prometheus text exposition format"""
+        def labels(endpoint, method):
+            return f'endpoint="{endpoint}",method="{method}"'
+
+        lines = []
+        with self._lock:
+            lines += ['# HELP assay_request_duration_seconds Time to handle a request.',
+                      '# TYPE assay_request_duration_seconds histogram']
+            for (endpoint, method, status), histogram in sorted(self.request_seconds.items()):
+                lines += histogram.samples('assay_request_duration_seconds', f'{labels(endpoint, method)},status="{status}"')
+            lines += ['# HELP assay_request_sql_statements SQL statements issued per request.',
+                      '# TYPE assay_request_sql_statements histogram']
+            for key, histogram in sorted(self.request_statements.items()):
+                lines += histogram.samples('assay_request_sql_statements', labels(*key))
+            lines += ['# HELP assay_request_sql_seconds_total Time spent executing SQL.',
+                      '# TYPE assay_request_sql_seconds_total counter']
+            lines += [f'assay_request_sql_seconds_total{{{labels(*key)}}} {seconds!r}'
+                      for key, seconds in sorted(self.request_sql_seconds.items())]
+            lines += ['# HELP assay_request_commits_total Transactions committed.',
+                      '# TYPE assay_request_commits_total counter']
+            lines += [f'assay_request_commits_total{{{labels(*key)}}} {commits}'
+                      for key, commits in sorted(self.request_commits.items())]
+            lines += ['# HELP assay_slow_requests_total Requests slower than SLOW_REQUEST_MS.',
+                      '# TYPE assay_slow_requests_total counter']
+            lines += [f'assay_slow_requests_total{{{labels(*key)}}} {count}'
+                      for key, count in sorted(self.slow_requests.items())]
+            lines += ['# HELP assay_section_duration_seconds Time spent in instrumented code.',
+                      '# TYPE assay_section_duration_seconds histogram']
+            for name, histogram in sorted(self.section_seconds.items()):
+                lines += histogram.samples('assay_section_duration_seconds', f'section="{name}"')
+        return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
+
+
+def metrics_enabled() -> bool:
+    return app.config.get('METRICS_ENABLED', False)
+
+
+def timed(section: str):
+    """decorator recording how long every call takes under section, when metrics are on"""
+    def decorate(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not metrics_enabled():
+                return fn(*args, **kwargs)
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                metrics.observe_section(section, time.perf_counter() - started)
+        return wrapper
+    return decorate
+
+
+@app.before_request
+def start_request_metrics():
+    if metrics_enabled():
+        g.request_counter = StatementCounter().__enter__()
+
+
+@app.after_request
+def record_request_metrics(response):
+    counter = g.pop('request_counter', None)
+    if counter is None:
+        return response
+    counter.__exit__(None, None, None)
+    endpoint = request.endpoint or 'unmatched'
+    slow = counter.elapsed * 1000 >= app.config.get('SLOW_REQUEST_MS', 500)
+    if slow:
+        logger.warning(
+            "slow request %s %s (%s): %.1f ms, %d statements taking %.1f ms, %d commits",
+            request.method, request.full_path, endpoint, counter.elapsed * 1000,
+            counter.count, counter.sql_elapsed * 1000, counter.commits
+        )
+    metrics.observe_request(endpoint, request.method, response.status_code, counter, slow)
+    return response
+
+
+@app.teardown_request
+def close_request_counter(exc):
+    # after_request is skipped when a request blows up, so make sure its
+    # counter doesn't stay open on this thread
+    counter = g.pop('request_counter', None)
+    if counter is not None and counter in _counters():
+        _counters().remove(counter)
@@ -1,7 +1,88 @@
-from typing import Union, List, Optional
-from sqlalchemy.orm import validates
+import math
+import re
+import numpy as np
+from typing import Union, List, Optional, Tuple, NamedTuple
+from sqlalchemy import select, insert, update, delete, event, func
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import validates, subqueryload
 from app import db, ma
 from exceptions import PlateNotFound, InvalidWellContents, WellOutOfBounds, InvalidPlateData
+from curves import dilution_series, curve_well_indices, SPACINGS, ORIENTATIONS
+from metrics import timed
+
+
+# Shared content rules
+# identifiers are a fixed letter followed by digits
+CELL_LINE_PATTERN = re.compile(r'c\d*')
+CHEMICAL_STR_ID_PATTERN = re.compile(r'O\d*')
+
+
+def check_cell_line(cell_line: Optional[str]) -> Optional[str]:
+    if cell_line and (type(cell_line) != str or not CELL_LINE_PATTERN.fullmatch(cell_line)):
+        raise InvalidWellContents(
+            f"'{cell_line}' is not a valid cell line identifier."
+            f" A valid cell line must begin with 'c' and be followed by a number sequence."
+        )
+    return cell_line
+
+
+def check_chemical_str_id(str_id: str) -> str:
+    if type(str_id) != str or not CHEMICAL_STR_ID_PATTERN.fullmatch(str_id):
+        raise InvalidWellContents(
+            f"'{str_id}' is not a valid chemical identifier."
+            f" A valid chemical must begin with 'O' and be followed by a number sequence."
+        )
+    return str_id
+
+
+def check_concentration(concentration: Optional[float]) -> Optional[float]:
+    """None is allowed and means the concentration isn't known"""
+    if concentration is None:
+        return concentration
+    if type(concentration) not in (int, float) or not math.isfinite(concentration):
+        raise InvalidWellContents(f"Concentration '{concentration}' must be a number.")
+    if concentration < 0:
+        raise InvalidWellContents(
+            f"submitted concentration {concentration} is less than 0. Concentrations must be positively signed."
+        )
+    return concentration
+
+
+def pair_chemicals(chemicals: Optional[Union[List[str], str]],
+                   concentrations: Optional[Union[List[float], float]]
+                   ) -> Tuple[List[str], List[Optional[float]]]:
+    """
+    turns the flexible chemical/concentration inputs into two lists of equal
+    length, without looking at the values themselves
+    """
+    if not chemicals:
+        return [], []
+    if type(chemicals) == str:
+        chemicals = [chemicals]
+    if concentrations:
+        if type(concentrations) != list:
+            concentrations = [concentrations]
+        if len(chemicals) != len(concentrations):
+            if len(concentrations) != 1:
+                # raise error for putting bad combination of chemicals and concentrations
+                raise InvalidWellContents(
+                    f"If multiple concentrations are submitted, there must be 1 or the same number of concentrations as chemicals."
+                )
+            else:
+                concentrations = concentrations * len(chemicals)
+    else:
+        concentrations = [None] * len(chemicals)
+    return list(chemicals), list(concentrations)
+
+
+def standardize_chemicals(chemicals: Optional[Union[List[str], str]],
+                          concentrations: Optional[Union[List[float], float]]
+                          ) -> Tuple[List[str], List[Optional[float]]]:
+    """pair_chemicals, then check every concentration"""
+    chemicals, concentrations = pair_chemicals(chemicals, concentrations)
+    for conc in concentrations:
+        check_concentration(conc)
+    return chemicals, concentrations
 
 
 # Models
@@ -16,6 +97,12 @@ class Well(db.Model):
     index = db.Column(db.Integer)
     cell_line = db.Column(db.String)
 
+    # one well per position on a plate. this is also what every well lookup
+    # and upsert goes through, so it doubles as the main read index
+    __table_args__ = (
+        db.Index('ix_well_plate_id_index', 'plate_id', 'index', unique=True),
+    )
+
     def __init__(self,
                  plate_id: int,
                  index: int,
@@ -23,116 +110,84 @@ class Well(db.Model):
                  chemicals: Optional[Union[List[str], str]] = None,
                  concentrations: Optional[Union[List[float], float]] = None
                  ):
+        """
+        Building a Well doesn't touch the session. Any chemicals given are
+        attached as ChemicalInWell links and saved along with the well once
+        the caller adds it.
+        """
         self.plate_id = plate_id
         self.cell_line = cell_line
         self.index = index
-        db.session.add(self)
-        db.session.commit()
 
-        if chemicals:
-            self.add_chemicals(chemicals, concentrations)
+        chemicals, concentrations = standardize_chemicals(chemicals, concentrations)
+        for chemical_str_id, concentration in zip(chemicals, concentrations):
+            check_chemical_str_id(chemical_str_id)
+            self.chemicals.append(ChemicalInWell(
+                chemical_str_id=chemical_str_id,
+                well_id=None,
+                concentration=concentration
+            ))
 
     @validates('cell_line')
     def validate_cell_line(self, key, cell_line):
-        if cell_line:
-            try:
-                assert cell_line.startswith('c')
-                for char in cell_line[1:]:
-                    assert char.isdigit()
-                return cell_line
-            except AssertionError:
-                raise InvalidWellContents(
-                    f"'{cell_line}' is not a valid cell line identifier."
-                    f" A valid cell line must begin with 'c' and be followed by a number sequence."
-                )
-        else:
-            return cell_line
-
-    @validates('concentrations')
-    def validate_concentrations(self, key, concentrations):
-        try:
-            if type(concentrations) == list:
-                assert all([conc > 0 for conc in concentrations])
-            else:
-                assert concentrations > 0
-            return concentrations
-        except AssertionError:
-            raise InvalidWellContents(
-                f"Concentrations must be greater than 0"
-            )
+        return check_cell_line(cell_line)
 
+    @timed('add_chemicals')
     def add_chemicals(self,
                       chemicals: Union[List[str], str],
                       concentrations: Union[List[float], float],
-                      overwrite_existing: bool = True):
+                      overwrite_existing: bool = True,
+                      change_op: str = 'chemicals'):
         # standardize inputs of chemicals/concentrations
-        if type(chemicals) == str:
-            chemicals = [chemicals]
-        if concentrations:
-            if type(concentrations) == float or type(concentrations) == int:
-                concentrations = [concentrations]
-            if len(chemicals) != len(concentrations):
-                if len(concentrations) != 1:
-                    # raise error for putting bad combination of chemicals and concentrations
-                    raise InvalidWellContents(
-                        f"If multiple concentrations are submitted, there must be 1 or the same number of concentrations as chemicals."
-                    )
-                else:
-                    concentrations = concentrations * len(chemicals)
-            for conc in concentrations:
-                if conc < 0:
-                    raise InvalidWellContents(
-                        f"submitted concentration {conc} is less than 0. Concentrations must be positively signed."
-                    )
+        chemicals, concentrations = standardize_chemicals(chemicals, concentrations)
+        for chemical_str_id in chemicals:
+            check_chemical_str_id(chemical_str_id)
+
+        record_well_changes(self.plate_id, [self.index], change_op)
 
         # If an over-write is needed, remove existing entries for this
         # well index from the chemicals in wells table
         if overwrite_existing:
-            existing_chemicals_in_well = ChemicalInWell.query.filter_by(well_id=self.id)
-            if existing_chemicals_in_well:
-                for chemical_in_well in existing_chemicals_in_well:
-                    db.session.delete(chemical_in_well)
-                    db.session.commit()
-
-        # for each specified chemical
-        for i, chemical_str_id in enumerate(chemicals):
-            if not concentrations:
-                concentration = None
-            else:
-                concentration = concentrations[i]
-            if Chemical.query.filter_by(str_id=chemical_str_id).first():
-                # chemical already exists, just add entry in association table
-                new_chemical_in_well = ChemicalInWell(
-                    chemical_str_id=chemical_str_id,
-                    well_id=self.id,
-                    concentration=concentration
-                )
-                db.session.add(new_chemical_in_well)
-                db.session.commit()
-            else:
-                # have to make new chemical entry before creating association table entry
-                new_chemical = Chemical(chemical_str_id)
-                db.session.add(new_chemical)
-                db.session.commit()
-                new_chemical_in_well = ChemicalInWell(
-                    chemical_str_id=new_chemical.str_id,
-                    well_id=self.id,
-                    concentration=concentration
-                )
-                db.session.add(new_chemical_in_well)
-                db.session.commit()
+            db.session.execute(delete(ChemicalInWell).where(ChemicalInWell.well_id == self.id))
+
+        # chemicals have to exist before the association table can point at them
+        chemical_registry.ensure(chemicals)
+        upsert_chemicals_in_wells([
+            {'chemical_str_id': chemical_str_id, 'well_id': self.id, 'concentration': concentrations[i]}
+            for i, chemical_str_id in enumerate(chemicals)
+        ])
+        db.session.commit()
+        db.session.expire(self, ['chemicals'])
+
+
+class EmptyWell(NamedTuple):
+    """
+    Stand-in for a well position nothing has been put in. Empty wells are
+    never stored, so reading an untouched well is free and never writes.
+    Serializes just like a stored well.
+    """
+    plate_id: int
+    index: int
+    cell_line: Optional[str] = None
+    chemicals: tuple = ()
 
 
 class Plate(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     size = db.Column(db.Integer)
     name = db.Column(db.String(100))
-    wells = db.relationship("Well", backref=db.backref('plate'))
+    # bumped once by every transaction that changes anything on the plate,
+    # so readers can tell whether what they have is still current
+    version = db.Column(db.Integer, nullable=False, default=0)
+    campaign_id = db.Column(db.Integer, db.ForeignKey('campaign.id'), index=True)
+    wells = db.relationship("Well", backref=db.backref('plate'), order_by="Well.index")
     _size_shape_map = {
         96: "12x8",
         384: "24x16",
-        1536: "48x24"
+        1536: "48x32"
     }
+    # (rows, cols) per plate size, parsed once instead of on every access
+    _shapes = {size: (int(shape.split('x')[1]), int(shape.split('x')[0])) for size, shape in _size_shape_map.items()}
 
     def __init__(self, name: str, size: int):
         self.size = size
@@ -140,81 +195,101 @@ class Plate(db.Model):
 
     @validates('size')
     def validate_size(self, key, size):
-        try:
-            assert size in self._size_shape_map.keys()
-            return size
-        except AssertionError:
+        if type(size) != int or size not in self._size_shape_map:
             raise InvalidPlateData(
                 f"{size} is not a valid plate size."
             )
+        return size
 
-    def make_empty_well(self, index: int, overwrite: bool = True) -> Well:
-        """Used to return a new well with minimal data if one doesnt already exist"""
+    def make_empty_well(self, index: int, overwrite: bool = True) -> EmptyWell:
+        """Used to empty out a well position. Empty wells aren't stored, so this just removes whatever is there"""
         self.check_index(index)
-        if Well.query.filter_by(plate_id=self.id, index=index).first():
-            if overwrite:
-                well_to_delete = Well.query.filter_by(plate_id=self.id, index=index).first()
-                db.session.delete(well_to_delete)
-                db.session.commit()
-            else:
-                raise InvalidWellContents(
-                    f"There is already a well here that you don't want to over write: plate id: {self.id}, index: {index}"
-                )
-        new_well = Well(self.id, index)
-        db.session.add(new_well)
+        if not overwrite and Well.query.filter_by(plate_id=self.id, index=index).first():
+            raise InvalidWellContents(
+                f"There is already a well here that you don't want to over write: plate id: {self.id}, index: {index}"
+            )
+        self.clear_wells([index])
         db.session.commit()
-        return new_well
-
-    def set_well_data(self, index: int, chemicals: Union[List[str], str], concentrations: Union[List[float], float], **kwargs) -> Well:
+        return EmptyWell(self.id, index)
+
+    def clear_wells(self, indices: List[int]) -> None:
+        """delete the stored wells (and their chemicals) at indices without committing"""
+        if not indices:
+            return
+        record_well_changes(self.id, indices, 'delete')
+        db.session.execute(delete(ChemicalInWell).where(ChemicalInWell.well_id.in_(
+            select(Well.id).where(Well.plate_id == self.id, Well.index.in_(indices))
+        )))
+        db.session.execute(
+            delete(Well).where(Well.plate_id == self.id, Well.index.in_(indices)),
+            execution_options={'synchronize_session': False}
+        )
+
+    @timed('set_well_data')
+    def set_well_data(self, index: int, chemicals: Union[List[str], str], concentrations: Union[List[float], float], **kwargs) -> Union[Well, EmptyWell]:
         """makes it easy to flexibly modify properties of well objects via their parent plate"""
         self.check_index(index)
-        if Well.query.filter_by(plate_id=self.id, index=index).first():
-            well_to_update = Well.query.filter_by(plate_id=self.id, index=index).first()
-            for kw, val in kwargs.items():
-                setattr(well_to_update, kw, val)
-            well_to_update.add_chemicals(chemicals=chemicals, concentrations=concentrations)
-            db.session.commit()
-            return well_to_update
-        else:
-            new_well = Well(plate_id=self.id,
-                            index=index,
-                            chemicals=chemicals,
-                            concentrations=concentrations,
-                            **kwargs)
-            db.session.add(new_well)
-            db.session.commit()
-            return new_well
+        if 'cell_line' in kwargs:
+            check_cell_line(kwargs['cell_line'])
+        chemical_str_ids = standardize_chemicals(chemicals, concentrations)[0]
+        for chemical_str_id in chemical_str_ids:
+            check_chemical_str_id(chemical_str_id)
+
+        # only wells with something in them are stored
+        if not chemical_str_ids and not kwargs.get('cell_line'):
+            well = Well.query.filter_by(plate_id=self.id, index=index).first()
+            if 'cell_line' in kwargs or not well or not well.cell_line:
+                return self.make_empty_well(index)
+
+        # create the well or update just the given properties in a single statement
+        upsert_wells(self.id, [{'index': index, **kwargs}], update_columns=tuple(kwargs))
+        well = Well.query.filter_by(plate_id=self.id, index=index).one()
+        db.session.refresh(well)
+        well.add_chemicals(chemicals=chemicals, concentrations=concentrations, change_op='set')
+        return well
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self._shapes[self.size]
 
     @property
     def num_rows(self) -> int:
-        return int(self._size_shape_map.get(self.size).split('x')[1])
+        return self._shapes[self.size][0]
 
     @property
     def num_cols(self) -> int:
-        return int(self._size_shape_map.get(self.size).split('x')[0])
+        return self._shapes[self.size][1]
 
-    def well(self, index: int) -> Well:
-        """get the well with the specified index if it exists or make + return a new empty well"""
+    def well(self, index: int) -> Union[Well, EmptyWell]:
+        """get the well with the specified index, or an EmptyWell if nothing has been put there"""
         self.check_index(index)
-        if Well.query.filter_by(plate_id=self.id, index=index).first():
-            return Well.query.filter_by(plate_id=self.id, index=index).first()
+        well = Well.query.filter_by(plate_id=self.id, index=index).first()
+        if well:
+            return well
         else:
-            return self.make_empty_well(index=index)
+            return EmptyWell(self.id, index)
 
     def get_index(self, row: int, col: int) -> int:
         """
         A1 -> index 0, counting horizontally and then moving to the next row down.
          rows, columns, and generic index are 0-indexed
          """
-        index = (self.num_cols - 1) * row + col
+        if row < 0 or row > self.num_rows - 1 or col < 0 or col > self.num_cols - 1:
+            raise WellOutOfBounds(
+                f"Invalid well position ({row}, {col}) for this plate type. This "
+                f"plate has {self.num_rows} rows and {self.num_cols} columns."
+            )
+        index = self.num_cols * row + col
         self.check_index(index)
         return index
 
-    def all_wells(self) -> List[Well]:
-        all_wells = []
-        for i in range(self.size):
-            all_wells.append(self.well(i))
-        return all_wells
+    def all_wells(self) -> List[Union[Well, EmptyWell]]:
+        """every position on the plate in index order, with EmptyWells filling the gaps, from one query"""
+        stored = {
+            well.index: well
+            for well in Well.query.options(subqueryload(Well.chemicals)).filter_by(plate_id=self.id)
+        }
+        return [stored.get(i) or EmptyWell(self.id, i) for i in range(self.size)]
 
     def check_index(self, index):
         if index > self.size - 1 or index < 0:
@@ -236,16 +311,7 @@ class Chemical(db.Model):
 
     @validates('str_id')
     def validate_str_id(self, key, str_id):
-        try:
-            assert str_id.startswith('O')
-            for char in str_id[1:]:
-                assert char.isdigit()
-            return str_id
-        except AssertionError:
-            raise InvalidWellContents(
-                f"'{str_id}' is not a valid chemical identifier."
-                f" A valid chemical must begin with 'O' and be followed by a number sequence."
-            )
+        return check_chemical_str_id(str_id)
 
 
 class ChemicalInWell(db.Model):
@@ -257,6 +323,14 @@ class ChemicalInWell(db.Model):
     # Data which only exists when a link exists between well and chemical
     concentration = db.Column(db.Float)
 
+    # the primary key leads with the chemical, so clearing a well's chemicals
+    # needs its own index on well_id. the second index answers "where is this
+    # chemical, and at what concentration" as a range scan
+    __table_args__ = (
+        db.Index('ix_chemical_in_well_well_id', 'well_id'),
+        db.Index('ix_chemical_in_well_chemical_concentration', 'chemical_str_id', 'concentration', 'well_id'),
+    )
+
     # support M2M relationship
     chemical = db.relationship("Chemical", backref=db.backref('wells', cascade="all", passive_deletes=True))
     well = db.relationship("Well", backref=db.backref('chemicals', cascade="all", passive_deletes=True))
@@ -267,43 +341,199 @@ class ChemicalInWell(db.Model):
         self.concentration = concentration
 
 
+class WellChange(db.Model):
+    """
+    Append-only log of well mutations, each tagged with the plate version
+    that made it. Lets clients pull only what changed since the version they
+    last saw instead of the whole plate.
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    plate_id = db.Column(db.Integer, db.ForeignKey('plate.id'), nullable=False)
+    version = db.Column(db.Integer, nullable=False)
+    index = db.Column(db.Integer, nullable=False)
+    # 'set', 'delete', 'chemicals', 'drc', 'clone', 'import' or 'upload'
+    op = db.Column(db.String(16), nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_well_change_plate_id_version', 'plate_id', 'version'),
+    )
+
+
+# Plate versions
+def bump_plate_version(plate_id: int) -> int:
+    """
+    Move the plate on to a new version for the current transaction and
+    return it. Repeat calls within one transaction reuse the same version,
+    so a single write is a single version however many steps it takes.
+    """
+    versions = db.session.info.setdefault('plate_versions', {})
+    if plate_id not in versions:
+        versions[plate_id] = db.session.execute(
+            update(Plate).where(Plate.id == plate_id).values(version=Plate.version + 1).returning(Plate.version),
+            execution_options={'synchronize_session': False}
+        ).scalar_one()
+    return versions[plate_id]
+
+
+# compact a plate's change log every this many versions
+WELL_CHANGE_COMPACT_EVERY = 64
+
+
+def record_well_changes(plate_id: int, indices: List[int], op: str) -> int:
+    """
+    log a mutation of the wells at indices under the plate's version for this
+    transaction, and drop the dose response curves the mutation wrote over
+    """
+    version = bump_plate_version(plate_id)
+    if indices:
+        db.session.execute(insert(WellChange), [
+            {'plate_id': plate_id, 'version': version, 'index': index, 'op': op} for index in indices
+        ])
+        drop_overwritten_curves(plate_id, indices)
+    if version % WELL_CHANGE_COMPACT_EVERY == 0:
+        compact_well_changes(plate_id)
+    return version
+
+
+def compact_well_changes(plate_id: int) -> None:
+    """
+    Drop every log entry that a later entry for the same well supersedes.
+    Only the latest change per well matters to a delta, so this loses nothing
+    a client could ask for.
+    """
+    latest = select(func.max(WellChange.id)).where(WellChange.plate_id == plate_id).group_by(WellChange.index)
+    db.session.execute(
+        delete(WellChange).where(WellChange.plate_id == plate_id, WellChange.id.not_in(latest)),
+        execution_options={'synchronize_session': False}
+    )
+
+
+@event.listens_for(db.session, 'after_commit')
+def forget_plate_versions_after_commit(session):
+    session.info.pop('plate_versions', None)
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def forget_plate_versions_after_rollback(session, previous_transaction):
+    session.info.pop('plate_versions', None)
+
+
+def drop_overwritten_curves(plate_id: int, indices: List[int]) -> None:
+    """
+    Delete the plate's dose response curves that cover any of the wells at
+    indices. Once one of its wells holds something else a curve no longer
+    describes the plate, and fitting it would fit the wrong wells. Curves are
+    checked a group of the same length and orientation at a time.
+    """
+    curves = db.session.execute(
+        select(DoseResponseCurve.id, DoseResponseCurve.starting_well_index, DoseResponseCurve.n_points,
+               DoseResponseCurve.orientation, Plate.size)
+        .join(Plate, Plate.id == DoseResponseCurve.plate_id)
+        .where(DoseResponseCurve.plate_id == plate_id)
+    ).all()
+    if not curves:
+        return
+    num_rows, num_cols = Plate._shapes[curves[0].size]
+    groups = {}
+    for curve in curves:
+        groups.setdefault((curve.n_points, curve.orientation), []).append(curve)
+    written = np.asarray(indices)
+    overwritten = []
+    for (n_points, orientation), group in groups.items():
+        starts = [curve.starting_well_index for curve in group]
+        hit = np.isin(curve_well_indices(starts, n_points, num_rows, num_cols, orientation), written).any(axis=1)
+        overwritten.extend(curve.id for curve, is_hit in zip(group, hit.tolist()) if is_hit)
+    if overwritten:
+        db.session.execute(delete(DoseResponseCurve).where(DoseResponseCurve.id.in_(overwritten)))
+
+
+# Upserts
+def dialect_insert(table):
+    """INSERT for whichever database we're connected to, so ON CONFLICT clauses are available"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(table)
+    return sqlite.insert(table)
+
+
+def upsert_wells(plate_id: int, rows: List[dict], update_columns: Tuple[str, ...] = ('cell_line',)) -> None:
+    """
+    Insert wells keyed on (plate_id, index). Wells that already exist get
+    update_columns overwritten and keep everything else, including their id.
+    """
+    if not rows:
+        return
+    stmt = dialect_insert(Well.__table__)
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['plate_id', 'index'],
+            set_={column: stmt.excluded[column] for column in update_columns}
+        )
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=['plate_id', 'index'])
+    db.session.execute(stmt, [{'plate_id': plate_id, **row} for row in rows])
+
+
+def upsert_chemicals_in_wells(rows: List[dict]) -> None:
+    """insert chemical/well links, replacing the concentration of any link that already exists"""
+    if not rows:
+        return
+    stmt = dialect_insert(ChemicalInWell.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['chemical_str_id', 'well_id'],
+        set_={'concentration': stmt.excluded.concentration}
+    )
+    db.session.execute(stmt, rows)
+
+
 class DoseResponseCurve(db.Model):
     """meant to serve as an anchor for post-assay analysis to quickly get assay curves"""
     id = db.Column(db.Integer, primary_key=True)
-    plate_id = db.Column(db.Integer, db.ForeignKey('plate.id'))
+    plate_id = db.Column(db.Integer, db.ForeignKey('plate.id'), index=True)
     starting_well_index = db.Column(db.Integer)
     n_points = db.Column(db.Integer)
     max_concentration = db.Column(db.Float)
     min_concentration = db.Column(db.Float)
     chemical = db.Column(db.String, db.ForeignKey('chemical.str_id'))
     orientation = db.Column(db.String)
+    # 'linear', 'log' or 'serial'. see curves.dilution_series
+    spacing = db.Column(db.String, default='linear')
+    dilution_factor = db.Column(db.Float)
+    # which copy of this chemical's curve on the plate this is, from 0
+    replicate = db.Column(db.Integer, default=0)
 
     def __init__(self,
                  plate_id: int,
                  starting_well_index: int,
                  n_points: int,
                  max_concentration: float,
-                 min_concentration: float,
+                 min_concentration: Optional[float],
                  chemical: str,
-                 orientation: str = 'horizontal'
+                 orientation: str = 'horizontal',
+                 spacing: str = 'linear',
+                 dilution_factor: Optional[float] = None,
+                 replicate: int = 0
                  ):
         self.plate_id = plate_id
         self.starting_well_index = starting_well_index
         self.n_points = n_points
+        self.spacing = spacing
+        self.dilution_factor = dilution_factor
         self.max_concentration = max_concentration
+        if spacing == 'serial' and min_concentration is None:
+            # a serial dilution's lowest point follows from the factor
+            min_concentration = float(dilution_series(max_concentration, None, n_points, spacing, dilution_factor)[-1])
         self.min_concentration = min_concentration
         self.chemical = chemical
         self.orientation = orientation
+        self.replicate = replicate
 
     @validates('plate_id')
     def validate_plate_id(self, key, plate_id):
-        try:
-            assert Plate.query.get(plate_id)
-            return plate_id
-        except AssertionError:
+        if not Plate.query.get(plate_id):
             raise PlateNotFound(
                 f"Plate '{plate_id}' does not exist yet so you can't make a DRC on it."
             )
+        return plate_id
 
     @validates('starting_well_index')
     def validate_starting_well_index(self, key, starting_well_index):
@@ -314,7 +544,7 @@ class DoseResponseCurve(db.Model):
         return starting_well_index
 
     @validates('max_concentration')
-    def validate_min_concentration(self, key, max_concentration):
+    def validate_max_concentration(self, key, max_concentration):
         self.validate_conc(max_concentration)
         return max_concentration
 
@@ -329,10 +559,19 @@ class DoseResponseCurve(db.Model):
 
     @validates('orientation')
     def validate_orientation(self, key, orientation):
-        if orientation not in ['vertical', 'horizontal']:
+        if orientation not in ORIENTATIONS:
             raise InvalidPlateData(
                 f"{orientation} is not a valid orientation. must be 'horizontal' or 'vertical'"
             )
+        return orientation
+
+    @validates('spacing')
+    def validate_spacing(self, key, spacing):
+        if spacing not in SPACINGS:
+            raise InvalidPlateData(
+                f"{spacing} is not a valid spacing. must be one of {', '.join(SPACINGS)}"
+            )
+        return spacing
 
     @staticmethod
     def validate_conc(concentration):
@@ -341,44 +580,47 @@ class DoseResponseCurve(db.Model):
                 f"Specified concentrations may not be negative."
             )
 
+    @timed('populate_wells')
     def populate_wells(self):
         # Do some business logic to get the list of wells/concentrations
         list_of_concentrations = self.calculate_curve()
-        list_of_wells = self.curve_wells
+        plate = self.plate
 
         # make/overwrite wells in those locations
         # setting cell_line will happen in bulk outside of the dose response curve.
         # the drc should only know about the chemical information
-        for i, well in enumerate(list_of_wells):
-            Plate.query.get(self.plate_id).set_well_data(
-                index=well.index,
+        for i, index in enumerate(self.curve_indices):
+            plate.set_well_data(
+                index=index,
                 chemicals=self.chemical,
                 concentrations=list_of_concentrations[i]
             )
 
     def calculate_curve(self) -> List[float]:
-        curve_span = (self.max_concentration - self.min_concentration)
-        regular_increments = curve_span / (self.n_points - 1)
-        curve_concentrations = []
-        for p in range(self.n_points):
-            next_point = self.max_concentration - p * regular_increments
-            curve_concentrations.append(next_point)
-        return curve_concentrations
+        return dilution_series(
+            self.max_concentration,
+            self.min_concentration,
+            self.n_points,
+            spacing=self.spacing or 'linear',
+            dilution_factor=self.dilution_factor
+        ).tolist()
+
+    @property
+    def curve_indices(self) -> List[int]:
+        """well indices covered by this curve, without touching the wells themselves"""
+        num_rows, num_cols = self.plate.shape
+        return curve_well_indices(
+            self.starting_well_index,
+            self.n_points,
+            num_rows,
+            num_cols,
+            orientation=self.orientation or 'horizontal'
+        ).tolist()
 
     @property
     def curve_wells(self) -> List[Well]:
-        try:
-            # this logic holds for horizontal curves, but could add for vertical curve capabilities
-            curve_wells = []
-            for w_index in range(self.starting_well_index, self.ending_well_index):
-                curve_wells.append(self.plate.well(w_index))
-            return curve_wells
-        except ValueError as e:
-            if "size" in e:
-                raise WellOutOfBounds(
-                    f"This dose response curve runs off the plate. "
-                    f"The following error was generated in the making of this DRC: {e}"
-                )
+        plate = self.plate
+        return [plate.well(w_index) for w_index in self.curve_indices]
 
     @property
     def ending_well_index(self) -> int:
@@ -389,6 +631,82 @@ class DoseResponseCurve(db.Model):
         return Plate.query.get(self.plate_id)
 
 
+class Campaign(db.Model):
+    """a screen spread over as many plates as its chemicals need, filled in the background"""
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100))
+    plate_size = db.Column(db.Integer)
+    # 'running', 'done' or 'failed'
+    status = db.Column(db.String(16), nullable=False, default='running')
+    n_plates = db.Column(db.Integer, nullable=False, default=0)
+    plates_done = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String)
+    # the chemicals, controls_per_plate and drc settings it was started with,
+    # so plates left unfilled by a restart can be filled again
+    settings = db.Column(db.JSON)
+    plates = db.relationship("Plate", backref=db.backref('campaign'), order_by="Plate.id")
+
+    def __init__(self, name: str, plate_size: int, n_plates: int, settings: Optional[dict] = None):
+        self.name = name
+        self.plate_size = plate_size
+        self.n_plates = n_plates
+        self.settings = settings
+        self.status = 'running'
+        self.plates_done = 0
+
+    @property
+    def plate_ids(self) -> List[int]:
+        return [plate.id for plate in self.plates]
+
+
+# Usage summaries. Each plate's rows are rebuilt, and the totals for whatever
+# they touch rolled up again, by the transaction that writes to the plate.
+# see summaries.py
+class PlateChemicalSummary(db.Model):
+    plate_id = db.Column(db.Integer, db.ForeignKey('plate.id'), primary_key=True)
+    chemical_str_id = db.Column(db.String, db.ForeignKey('chemical.str_id'), primary_key=True)
+    n_wells = db.Column(db.Integer, nullable=False)
+    min_concentration = db.Column(db.Float)
+    max_concentration = db.Column(db.Float)
+
+    __table_args__ = (
+        db.Index('ix_plate_chemical_summary_chemical_str_id', 'chemical_str_id'),
+    )
+
+
+class PlateCellLineSummary(db.Model):
+    plate_id = db.Column(db.Integer, db.ForeignKey('plate.id'), primary_key=True)
+    cell_line = db.Column(db.String, primary_key=True)
+    n_wells = db.Column(db.Integer, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_plate_cell_line_summary_cell_line', 'cell_line'),
+    )
+
+
+class ChemicalSummary(db.Model):
+    chemical_str_id = db.Column(db.String, db.ForeignKey('chemical.str_id'), primary_key=True)
+    n_wells = db.Column(db.Integer, nullable=False)
+    n_plates = db.Column(db.Integer, nullable=False)
+    min_concentration = db.Column(db.Float)
+    max_concentration = db.Column(db.Float)
+
+
+class CellLineSummary(db.Model):
+    cell_line = db.Column(db.String, primary_key=True)
+    n_wells = db.Column(db.Integer, nullable=False)
+    n_plates = db.Column(db.Integer, nullable=False)
+
+
+# Plate reader results. One row per plate and readout holding a value for
+# every well as a packed float64 array, NaN where a well wasn't read.
+# see readouts.py
+class PlateReadout(db.Model):
+    plate_id = db.Column(db.Integer, db.ForeignKey('plate.id'), primary_key=True)
+    name = db.Column(db.String(100), primary_key=True)
+    values = db.Column(db.LargeBinary, nullable=False)
+
+
 # Schemas
 class ChemicalSchema(ma.Schema):
     class Meta:
@@ -413,9 +731,44 @@ class PlateSchema(ma.Schema):
         fields = ('id', 'size', 'name', 'wells')
 
 
+class CampaignSchema(ma.Schema):
+    class Meta:
+        fields = ('id', 'name', 'status', 'plate_size', 'n_plates', 'plates_done', 'error', 'plate_ids')
+
+
+class ChemicalSummarySchema(ma.Schema):
+    class Meta:
+        fields = ('chemical_str_id', 'n_wells', 'n_plates', 'min_concentration', 'max_concentration')
+
+
+class CellLineSummarySchema(ma.Schema):
+    class Meta:
+        fields = ('cell_line', 'n_wells', 'n_plates')
+
+
+class PlateChemicalSummarySchema(ma.Schema):
+    class Meta:
+        fields = ('chemical_str_id', 'n_wells', 'min_concentration', 'max_concentration')
+
+
+class PlateCellLineSummarySchema(ma.Schema):
+    class Meta:
+        fields = ('cell_line', 'n_wells')
+
+
 # Init Schemas
 plate_schema = PlateSchema()
 plates_schema = PlateSchema(many=True)
+plate_summary_schema = PlateSchema(exclude=('wells',))
+plate_summaries_schema = PlateSchema(many=True, exclude=('wells',))
 well_schema = WellSchema()
 wells_schema = WellSchema(many=True)
-chemicals_schema = ChemicalSchema(many=True)
\ No newline at end of file
+chemicals_schema = ChemicalSchema(many=True)
+campaign_schema = CampaignSchema()
+chemical_summaries_schema = ChemicalSummarySchema(many=True)
+cell_line_summaries_schema = CellLineSummarySchema(many=True)
+plate_chemical_summaries_schema = PlateChemicalSummarySchema(many=True)
+plate_cell_line_summaries_schema = PlateCellLineSummarySchema(many=True)
+
+from registry import chemical_registry
+import summaries  # noqa: F401  (registers the before_commit summary hook)
@@ -0,0 +1,168 @@
+import re
+from typing import List, Optional, Iterable
+import numpy as np
+from sqlalchemy import select
+from app import app, db
+from exceptions import InvalidPlateData
+from model import Plate, DoseResponseCurve, PlateReadout, dialect_insert
+from curves import dilution_series, curve_well_indices
+from fitting import fit_logistic
+from metrics import timed
+
+READOUT_NAME = re.compile(r'^[A-Za-z0-9_.-]{1,100}$')
+# stored little endian whatever the server is
+READOUT_DTYPE = np.dtype('<f8')
+# curves fit per batch, which bounds the memory a whole campaign takes
+FIT_BATCH_SIZE = app.config.get('FIT_BATCH_SIZE', 20000)
+
+
+def check_readout_name(name: str) -> str:
+    if not READOUT_NAME.match(name):
+        raise InvalidPlateData(
+            f"'{name}' is not a valid readout name. Use up to 100 letters, numbers, '_', '-' or '.'."
+        )
+    return name
+
+
+def pack_readout(plate: Plate, values) -> bytes:
+    """
+    A value for every well, either as one flat list in index order or as a
+    list per row, packed into a float64 array. null marks a well that
+    wasn't read and is stored as NaN.
+    """
+    try:
+        array = np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        raise InvalidPlateData(f"Readout values must be numbers, or null for wells that weren't read.")
+    if array.shape not in ((plate.size,), (plate.num_rows, plate.num_cols)):
+        raise InvalidPlateData(
+            f"A readout for plate {plate.id} needs {plate.size} values, or {plate.num_rows} rows of "
+            f"{plate.num_cols}, not an array of shape {array.shape}."
+        )
+    if np.isinf(array).any():
+        raise InvalidPlateData(f"Readout values must be finite.")
+    return array.ravel().astype(READOUT_DTYPE).tobytes()
+
+
+def unpack_readout(packed: bytes) -> np.ndarray:
+    return np.frombuffer(packed, dtype=READOUT_DTYPE)
+
+
+def save_readout(plate: Plate, name: str, values) -> int:
+    """store or replace one readout for the plate without committing. returns how many wells have a value"""
+    packed = pack_readout(plate, values)
+    stmt = dialect_insert(PlateReadout.__table__)
+    stmt = stmt.on_conflict_do_update(index_elements=['plate_id', 'name'], set_={'values': stmt.excluded['values']})
+    db.session.execute(stmt, [{'plate_id': plate.id, 'name': check_readout_name(name), 'values': packed}])
+    return int(np.isfinite(unpack_readout(packed)).sum())
+
+
+def load_readout(plate_id: int, name: str) -> Optional[np.ndarray]:
+    packed = db.session.scalar(
+        select(PlateReadout.values).where(PlateReadout.plate_id == plate_id, PlateReadout.name == name)
+    )
+    return None if packed is None else unpack_readout(packed)
+
+
+def readout_list(values: np.ndarray) -> List[Optional[float]]:
+    """a readout as JSON wants it, with None for the wells that weren't read"""
+    return [None if value != value else value for value in values.tolist()]
+
+
+def readout_names(plate_id: int) -> List[str]:
+    return list(db.session.scalars(
+        select(PlateReadout.name).where(PlateReadout.plate_id == plate_id).order_by(PlateReadout.name)
+    ))
+
+
+def optional_float(value) -> Optional[float]:
+    return float(value) if np.isfinite(value) else None
+
+
+@timed('fit_curves')
+def fit_plate_curves(plate_ids: Iterable[int], readout: str) -> dict:
+    """
+    Fit a 4 parameter logistic to every dose response curve on the plates,
+    against the named readout. The curves and readouts are read in two
+    queries, each curve's wells and doses are worked out a group of alike
+    curves at a time by the curves engine, and the fits are done together
+    by fitting.fit_logistic. Plates without the readout are listed rather
+    than failing the rest.
+    """
+    plate_ids = sorted(set(plate_ids))
+    curves = db.session.execute(
+        select(
+            DoseResponseCurve.id, DoseResponseCurve.plate_id, Plate.size, DoseResponseCurve.chemical,
+            DoseResponseCurve.replicate, DoseResponseCurve.starting_well_index, DoseResponseCurve.n_points,
+            DoseResponseCurve.max_concentration, DoseResponseCurve.min_concentration, DoseResponseCurve.orientation,
+            DoseResponseCurve.spacing, DoseResponseCurve.dilution_factor
+        )
+        .join(Plate, Plate.id == DoseResponseCurve.plate_id)
+        .where(DoseResponseCurve.plate_id.in_(plate_ids))
+        .order_by(DoseResponseCurve.plate_id, DoseResponseCurve.id)
+    ).all()
+    readouts = {
+        plate_id: unpack_readout(packed) for plate_id, packed in db.session.execute(
+            select(PlateReadout.plate_id, PlateReadout.values)
+            .where(PlateReadout.plate_id.in_(plate_ids), PlateReadout.name == readout)
+        )
+    }
+    missing = sorted({curve.plate_id for curve in curves if curve.plate_id not in readouts})
+    curves = [curve for curve in curves if curve.plate_id in readouts]
+
+    # every plate's readout end to end, so any curve's responses are one fancy index away
+    offset, total = {}, 0
+    for plate_id, plate_values in readouts.items():
+        offset[plate_id] = total
+        total += len(plate_values)
+    values = np.concatenate(list(readouts.values())) if readouts else np.empty(0)
+
+    # doses and responses for every curve, padded with NaN to the longest
+    width = max((curve.n_points for curve in curves), default=0)
+    concentrations = np.full((len(curves), width), np.nan)
+    responses = np.full((len(curves), width), np.nan)
+    groups = {}
+    for row, curve in enumerate(curves):
+        key = (curve.size, curve.n_points, curve.orientation or 'horizontal', curve.spacing or 'linear')
+        groups.setdefault(key, []).append(row)
+    for (size, n_points, orientation, spacing), rows in groups.items():
+        group = [curves[row] for row in rows]
+        num_rows, num_cols = Plate._shapes[size]
+        indices = curve_well_indices([curve.starting_well_index for curve in group], n_points, num_rows, num_cols,
+                                     orientation)
+        concentrations[rows, :n_points] = dilution_series(
+            [curve.max_concentration for curve in group],
+            None if spacing == 'serial' else [curve.min_concentration for curve in group],
+            n_points, spacing,
+            [curve.dilution_factor for curve in group] if spacing == 'serial' else None
+        )
+        offsets = np.array([offset[curve.plate_id] for curve in group])[:, None]
+        responses[rows, :n_points] = values[offsets + indices]
+
+    fits = []
+    for start in range(0, len(curves), FIT_BATCH_SIZE):
+        batch = slice(start, start + FIT_BATCH_SIZE)
+        fit = fit_logistic(concentrations[batch], responses[batch])
+        # keys in sorted order, so serializers.encode writes them the way jsonify would
+        for i, curve in enumerate(curves[batch]):
+            fits.append({
+                'bottom': optional_float(fit.bottom[i]),
+                'chemical': curve.chemical,
+                'converged': bool(fit.converged[i]),
+                'curve_id': curve.id,
+                'hill': optional_float(fit.hill[i]),
+                'ic50': optional_float(fit.ic50[i]),
+                'n_points': int(fit.n_points[i]),
+                'plate_id': curve.plate_id,
+                'r_squared': optional_float(fit.r_squared[i]),
+                'replicate': curve.replicate,
+                'starting_well_index': curve.starting_well_index,
+                'top': optional_float(fit.top[i])
+            })
+    return {
+        'fits': fits,
+        'missing_readout': missing,
+        'n_converged': sum(fit['converged'] for fit in fits),
+        'n_curves': len(fits),
+        'readout': readout
+    }
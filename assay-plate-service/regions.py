@@ -0,0 +1,135 @@
+import re
+from typing import Optional, NamedTuple, List
+from sqlalchemy import select, delete, and_, between
+from app import db
+from exceptions import WellOutOfBounds
+from model import Plate, Well, ChemicalInWell, record_well_changes
+
+# A, B, ... Z, AA, AB, ... - 1536 well plates run to AF
+_ROW = r'[A-Za-z]{1,2}'
+_COL = r'[0-9]{1,2}'
+WELL_NAME = re.compile(rf'^({_ROW})({_COL})$')
+WELL_RANGE = re.compile(rf'^({_ROW})({_COL}):({_ROW})({_COL})$')
+ROW_RANGE = re.compile(rf'^({_ROW})(?::({_ROW}))?$')
+COL_RANGE = re.compile(rf'^({_COL})(?::({_COL}))?$')
+
+
+def row_number(letters: str) -> int:
+    """'A' -> 0, 'Z' -> 25, 'AA' -> 26"""
+    number = 0
+    for letter in letters.upper():
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number - 1
+
+
+def row_letters(row: int) -> str:
+    """0 -> 'A', 25 -> 'Z', 26 -> 'AA'"""
+    letters = ''
+    row += 1
+    while row:
+        row, remainder = divmod(row - 1, 26)
+        letters = chr(ord('A') + remainder) + letters
+    return letters
+
+
+def well_name(plate: Plate, index: int) -> str:
+    """A1 style name of a well index, e.g. 13 -> 'B2' on a 96 well plate"""
+    row, col = divmod(index, plate.num_cols)
+    return f"{row_letters(row)}{col + 1}"
+
+
+class Region(NamedTuple):
+    """inclusive, zero based rectangle of rows and columns on a plate"""
+    first_row: int
+    last_row: int
+    first_col: int
+    last_col: int
+
+    def indices(self, plate: Plate) -> List[int]:
+        return [row * plate.num_cols + col
+                for row in range(self.first_row, self.last_row + 1)
+                for col in range(self.first_col, self.last_col + 1)]
+
+    def where(self, plate: Plate):
+        """
+        SQL condition picking out the region's wells on plate. Wells are
+        numbered row by row, so any rectangle lies inside one range of
+        Well.index that the (plate_id, index) index can seek to. Only when
+        the rectangle is narrower than the plate do columns outside it need
+        filtering out of that range.
+        """
+        num_cols = plate.num_cols
+        condition = and_(
+            Well.plate_id == plate.id,
+            between(Well.index, self.first_row * num_cols + self.first_col, self.last_row * num_cols + self.last_col)
+        )
+        if self.first_col > 0 or self.last_col < num_cols - 1:
+            condition = and_(condition, between(Well.index % num_cols, self.first_col, self.last_col))
+        return condition
+
+
+def parse_region(plate: Plate,
+                 region: Optional[str] = None,
+                 row: Optional[str] = None,
+                 col: Optional[str] = None) -> Region:
+    """
+    Turn request selectors into a Region on plate. Exactly one of:
+     - region: a well ('B3') or rectangle of wells ('A1:H12')
+     - row: a row ('C') or run of rows ('C:E')
+     - col: a 1 based column ('5') or run of columns ('5:8')
+    """
+    given = [name for name, value in (('region', region), ('row', row), ('col', col)) if value is not None]
+    if len(given) != 1:
+        raise WellOutOfBounds(f"Select wells with exactly one of region, row or col.")
+
+    last_row, last_col = plate.num_rows - 1, plate.num_cols - 1
+    if region is not None:
+        match = WELL_NAME.match(region) or WELL_RANGE.match(region)
+        if not match:
+            raise WellOutOfBounds(f"'{region}' is not a well like 'B3' or a range of wells like 'A1:H12'.")
+        parts = match.groups()
+        first_row, first_col = row_number(parts[0]), int(parts[1]) - 1
+        if len(parts) == 2:
+            bounds = (first_row, first_row, first_col, first_col)
+        else:
+            bounds = (first_row, row_number(parts[2]), first_col, int(parts[3]) - 1)
+    elif row is not None:
+        match = ROW_RANGE.match(row)
+        if not match:
+            raise WellOutOfBounds(f"'{row}' is not a row like 'C' or a range of rows like 'C:E'.")
+        first, last = match.groups()
+        bounds = (row_number(first), row_number(last or first), 0, last_col)
+    else:
+        match = COL_RANGE.match(col)
+        if not match:
+            raise WellOutOfBounds(f"'{col}' is not a column like '5' or a range of columns like '5:8'.")
+        first, last = match.groups()
+        bounds = (0, last_row, int(first) - 1, int(last or first) - 1)
+
+    first_row, end_row, first_col, end_col = bounds
+    if not (0 <= first_row <= end_row <= last_row and 0 <= first_col <= end_col <= last_col):
+        raise WellOutOfBounds(
+            f"That selection doesn't fit this plate type. This plate has rows A to "
+            f"{row_letters(last_row)} and columns 1 to {last_col + 1}, and ranges must run "
+            f"from the first well to the last."
+        )
+    return Region(*bounds)
+
+
+def clear_region(plate: Plate, region: Region) -> List[int]:
+    """
+    Delete every stored well in region, chemicals included, without
+    committing. The wells go in one ranged DELETE that hands back the
+    indices it removed for the change log. Returns those indices.
+    """
+    condition = region.where(plate)
+    db.session.execute(delete(ChemicalInWell).where(ChemicalInWell.well_id.in_(
+        select(Well.id).where(condition)
+    )))
+    indices = db.session.scalars(
+        delete(Well).where(condition).returning(Well.index),
+        execution_options={'synchronize_session': False}
+    ).all()
+    if indices:
+        record_well_changes(plate.id, sorted(indices), 'delete')
+    return sorted(indices)
@@ -0,0 +1,77 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable
+from sqlalchemy import event
+from app import app, db
+from model import Chemical, dialect_insert, check_chemical_str_id
+
+
+class ChemicalRegistry:
+    """
+    Remembers which chemical str_ids are already in the database so well
+    writes don't have to look them up every time. Only committed chemicals
+    are remembered. Chemicals created inside a transaction wait in the
+    session until it commits, and are forgotten if it rolls back.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._known = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_known(self, str_id: str) -> bool:
+        with self._lock:
+            if str_id in self._known:
+                self._known.move_to_end(str_id)
+                return True
+            return False
+
+    def remember(self, str_ids: Iterable[str]) -> None:
+        with self._lock:
+            for str_id in str_ids:
+                self._known[str_id] = None
+                self._known.move_to_end(str_id)
+            while len(self._known) > self.max_size:
+                self._known.popitem(last=False)
+
+    def forget(self, str_ids: Iterable[str]) -> None:
+        with self._lock:
+            for str_id in str_ids:
+                self._known.pop(str_id, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._known.clear()
+
+    def ensure(self, str_ids: Iterable[str]) -> None:
+        """
+        Make sure every chemical in str_ids exists. Anything not already known
+        is created with one INSERT ... ON CONFLICT DO NOTHING, so a whole batch
+        of wells costs at most one chemical statement.
+        """
+        unknown = sorted({str_id for str_id in str_ids if not self.is_known(str_id)})
+        if not unknown:
+            return
+        for str_id in unknown:
+            check_chemical_str_id(str_id)
+        stmt = dialect_insert(Chemical.__table__).on_conflict_do_nothing(index_elements=['str_id'])
+        db.session.execute(stmt, [{'str_id': str_id} for str_id in unknown])
+        db.session.info.setdefault('pending_chemicals', set()).update(unknown)
+
+
+chemical_registry = ChemicalRegistry(max_size=app.config.get('CHEMICAL_CACHE_SIZE', 4096))
+
+
+@event.listens_for(db.session, 'after_commit')
+def remember_committed_chemicals(session):
+    chemical_registry.remember(session.info.pop('pending_chemicals', ()))
+
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def forget_rolled_back_chemicals(session, previous_transaction):
+    session.info.pop('pending_chemicals', None)
+
+
+@event.listens_for(Chemical, 'after_delete')
+def forget_deleted_chemical(mapper, connection, target):
+    chemical_registry.forget([target.str_id])
@@ -1,7 +1,102 @@
+from typing import List
+from concurrent import futures
+from urllib.parse import urlencode
 from app import app, db
-from flask import request, jsonify
-from exceptions import PlateNotFound, InvalidWellContents, WellOutOfBounds
-from model import Plate, Well, DoseResponseCurve, Chemical, plate_schema, plates_schema, well_schema, wells_schema, chemicals_schema
+from flask import request, jsonify, Response, stream_with_context
+from exceptions import PlateNotFound, InvalidWellContents, InvalidPlateData, WriteTimedOut
+from model import Plate, Well, EmptyWell, WellChange, Chemical, ChemicalInWell, Campaign, \
+    ChemicalSummary, CellLineSummary, PlateChemicalSummary, PlateCellLineSummary, plate_schema, well_schema, wells_schema, \
+    chemicals_schema, plate_summaries_schema, campaign_schema, \
+    chemical_summaries_schema, cell_line_summaries_schema, plate_chemical_summaries_schema, plate_cell_line_summaries_schema
+from bulk import parse_well_spec, parse_well_specs, write_wells, clone_plate
+from drc import plan_dose_response_curves, apply_dose_response_plan
+from metrics import StatementCounter, metrics, metrics_enabled
+from cache import plate_response_cache
+from regions import parse_region, clear_region
+from campaigns import start_campaign
+from exchange import EXCHANGE_FORMATS, check_format, export_plate, import_plate
+from ingest import ingest_plate_map
+from readouts import save_readout, load_readout, readout_names, readout_list, fit_plate_curves
+from serializers import plate_dicts, plates_json, plate_json, wells_json, well_dict, encode, encode_line, \
+    negotiate_encoding, compress, MIN_COMPRESS_SIZE
+from database import reads_only, commits_repeatedly
+from coalesce import coalescing_enabled, well_write_coalescer, WRITE_COALESCE_TIMEOUT_S
+from sqlalchemy import select, func, or_, and_
+from sqlalchemy.orm import selectinload, subqueryload
+
+# how many plates are pulled off the cursor and serialized at a time when streaming
+STREAM_CHUNK_SIZE = 100
+# default and largest page sizes for GET /chemicals/<str_id>/wells
+CHEMICAL_WELLS_PAGE_SIZE = 1000
+CHEMICAL_WELLS_MAX_PAGE_SIZE = app.config.get('CHEMICAL_WELLS_MAX_PAGE_SIZE', 10000)
+
+
+def stream_plates(after_id: int = None, limit: int = None, include_wells: bool = True):
+    """
+    Yield one serialized plate per line. Plates come off a server-side cursor
+    a chunk at a time, and each chunk's wells are read in one query, written
+    out and dropped before the next, so memory stays flat however many
+    plates exist.
+    """
+    stmt = select(Plate.id, Plate.name, Plate.size).order_by(Plate.id)
+    if after_id is not None:
+        stmt = stmt.where(Plate.id > after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    result = db.session.execute(stmt.execution_options(stream_results=True, yield_per=STREAM_CHUNK_SIZE))
+    for plates in result.tuples().partitions():
+        for plate in plate_dicts(plates, include_wells):
+            yield encode_line(plate)
+
+
+def json_response(body: bytes, compressible: bool = True, mimetype: str = 'application/json') -> Response:
+    """a response for an already serialized body, compressed if the client takes it and it's worth it"""
+    encoding = negotiate_encoding(request.accept_encodings) if compressible and len(body) >= MIN_COMPRESS_SIZE else None
+    response = Response(compress(body, encoding), mimetype=mimetype)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    return response
+
+
+def cached_plate_response(plate_id, view: str, build, mimetype: str = 'application/json',
+                          compressible: bool = True) -> Response:
+    """
+    Serve a per-plate response from the cache when the plate hasn't changed.
+    The current version is one indexed lookup. Clients that send back our
+    ETag get a 304, and anyone else gets the cached bytes. build returns the
+    serialized body and is only called when this version of the view hasn't
+    been serialized yet. Compressed bodies are cached per encoding too.
+    """
+    version = db.session.scalar(select(Plate.version).where(Plate.id == plate_id))
+    if version is None:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    key = (str(plate_id), version, view)
+    body = plate_response_cache.get(key)
+    if body is None:
+        body = build()
+        plate_response_cache.put(key, body)
+
+    encoding = negotiate_encoding(request.accept_encodings) if compressible and len(body) >= MIN_COMPRESS_SIZE else None
+    etag = f"{plate_id}-{version}-{view}" + (f"-{encoding}" if encoding else '')
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        if encoding:
+            compressed = plate_response_cache.get(key + (encoding,))
+            if compressed is None:
+                compressed = compress(body, encoding)
+                plate_response_cache.put(key + (encoding,), compressed)
+            body = compressed
+        response = Response(body, mimetype=mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(etag)
+    if compressible:
+        response.vary.add('Accept-Encoding')
+    return response
 
 
 # Make a new plate
@@ -28,19 +123,41 @@ def add_plate():
 # Get plate info
 @app.route('/plates', methods=['GET'])
 def get_all_plates():
+    # keyset pagination: pass the last id you've seen as after_id to get the next page
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', type=int)
+    if limit is not None and limit < 1:
+        raise InvalidPlateData(f"limit must be at least 1, not '{limit}'.")
+    include_wells = request.args.get('wells', 'true').lower() not in ('false', '0', 'no')
+
+    if request.accept_mimetypes.best == 'application/x-ndjson':
+        return Response(
+            stream_with_context(stream_plates(after_id, limit, include_wells)),
+            mimetype='application/x-ndjson'
+        )
+
+    stmt = select(Plate.id, Plate.name, Plate.size).order_by(Plate.id)
+    if after_id is not None:
+        stmt = stmt.where(Plate.id > after_id)
+    if limit is not None:
+        stmt = stmt.limit(limit)
+    plates = db.session.execute(stmt).tuples().all()
+
     # return serialized plate object
-    plates = Plate.query.all()
-    return plates_schema.jsonify(plates)
+    response = json_response(plates_json(plates, include_wells))
+    if plates and limit is not None and len(plates) == limit:
+        wells_arg = '' if include_wells else '&wells=false'
+        response.headers['Link'] = f'</plates?after_id={plates[-1][0]}&limit={limit}{wells_arg}>; rel="next"'
+    return response
 
 
 # Get plate info
 @app.route('/plates/<plate_id>', methods=['GET'])
 def get_plate(plate_id):
     # return serialized plate object
-    plate = Plate.query.get(plate_id)
-    if not plate:
-        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
-    return plate_schema.jsonify(plate)
+    def build():
+        return plate_json(db.session.get(Plate, plate_id))
+    return cached_plate_response(plate_id, 'plate', build)
 
 
 # Make a new well
@@ -57,37 +174,267 @@ def populate_well(plate_id):
         )
 
 
+    if coalescing_enabled():
+        # the writer thread does the writing
+        reads_only()
+
     # create new object
     plate = Plate.query.get(plate_id)
     if not plate:
         raise PlateNotFound(
             f"Plate {plate_id} doesn't exist yet!"
         )
+    if coalescing_enabled():
+        return populate_well_coalesced(plate, row, col, cell_line, chemical, concentration)
     well_index = plate.get_index(row, col)
-    well_to_populate = plate.well(well_index)
-    well_to_populate.cell_line = cell_line
-    well_to_populate.add_chemicals(chemical, concentration)
-    db.session.add(well_to_populate)
-    db.session.commit()
+    well_to_populate = plate.set_well_data(well_index, chemical, concentration, cell_line=cell_line)
     return well_schema.jsonify(well_to_populate)
 
 
-# Get all wells for a plate
+def populate_well_coalesced(plate: Plate, row, col, cell_line, chemical, concentration) -> Response:
+    """
+    The same write, validated here and then handed to the write coalescer so
+    it's committed together with whatever other wells are being written
+    right now. The response is built from what was written.
+    """
+    spec = parse_well_spec(plate, {
+        'row': row, 'col': col, 'cell_line': cell_line, 'chemical': chemical, 'concentration': concentration
+    })
+    plate_id = plate.id
+    # let go of this request's connection, and any lock it holds, while the writer thread commits
+    db.session.close()
+    future = well_write_coalescer.submit(plate_id, spec)
+    try:
+        written = future.result(timeout=WRITE_COALESCE_TIMEOUT_S)
+    except futures.TimeoutError:
+        # a write the writer thread hasn't picked up yet is dropped. one it
+        # already has is about to commit, so that one is waited out
+        if future.cancel():
+            raise WriteTimedOut(
+                f"Well {spec.index} of plate {plate_id} wasn't written within {WRITE_COALESCE_TIMEOUT_S}s. "
+                f"Nothing was written, so it's safe to retry."
+            )
+        written = future.result()
+    return json_response(
+        encode(well_dict(plate_id, written.index, written.cell_line, written.chemicals, written.concentrations)),
+        compressible=False
+    )
+
+
+# Make or overwrite many wells at once
+@app.route('/plates/<plate_id>/wells:batch', methods=['POST'])
+def populate_wells(plate_id):
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(
+            f"Plate {plate_id} doesn't exist yet!"
+        )
+
+    # validate everything before touching the db so the batch is all-or-nothing
+    specs, errors = parse_well_specs(plate, request.json['wells'])
+    if errors:
+        return jsonify({'plate_id': plate.id, 'errors': errors}), InvalidWellContents.code
+
+    try:
+        write_wells(plate, specs)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    written_wells = Well.query.options(selectinload(Well.chemicals)).filter(
+        Well.plate_id == plate.id,
+        Well.index.in_([spec.index for spec in specs])
+    ).order_by(Well.index)
+    return wells_schema.jsonify(written_wells)
+
+
+# Stream in a CSV/TSV plate map covering any number of plates
+@app.route('/plates:upload', methods=['POST'])
+def upload_plate_map():
+    default_plate_id = request.args.get('plate_id', type=int)
+    delimiter = {'tab': '\t', 'comma': ','}.get(request.args.get('delimiter'))
+    if 'file' in request.files:
+        upload = request.files['file']
+        stream = upload.stream
+        if delimiter is None and upload.filename and upload.filename.lower().endswith('.tsv'):
+            delimiter = '\t'
+    else:
+        stream = request.stream
+        if delimiter is None and request.mimetype == 'text/tab-separated-values':
+            delimiter = '\t'
+    # every chunk is its own write transaction
+    commits_repeatedly()
+    report = ingest_plate_map(stream, default_plate_id=default_plate_id, delimiter=delimiter)
+    return jsonify(report.to_dict())
+
+
+# Get all wells for a plate, or just the ones in a region
 @app.route('/plates/<plate_id>/wells', methods=['GET'])
 def view_wells(plate_id):
-    all_wells = Well.query.filter_by(plate_id=plate_id)
-    return wells_schema.jsonify(all_wells)
+    # ?empty=true also returns the untouched positions, which are never stored
+    include_empty = request.args.get('empty', 'false').lower() in ('true', '1', 'yes')
+    selectors = {name: request.args.get(name) for name in ('region', 'row', 'col')}
+    if any(selectors.values()):
+        return view_region(plate_id, selectors, include_empty)
+
+    if include_empty:
+        def build():
+            plate = db.session.get(Plate, plate_id)
+            return wells_json(plate, indices=range(plate.size))
+        return cached_plate_response(plate_id, 'wells-with-empty', build)
+
+    def build():
+        return wells_json(db.session.get(Plate, plate_id))
+    return cached_plate_response(plate_id, 'wells', build)
+
+
+def view_region(plate_id, selectors: dict, include_empty: bool) -> Response:
+    """?region=A1:H12, ?row=C or ?col=5, fetched with one ranged query on the well index"""
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    region = parse_region(plate, **selectors)
+
+    def build():
+        return wells_json(plate, where=region.where(plate), indices=region.indices(plate) if include_empty else None)
+    view = f"wells-{'with-empty-' if include_empty else ''}{'-'.join(map(str, region))}"
+    return cached_plate_response(plate_id, view, build)
+
+
+# Empty every well in a region
+@app.route('/plates/<plate_id>/wells', methods=['DELETE'])
+def delete_wells(plate_id):
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    region = parse_region(plate, **{name: request.args.get(name) for name in ('region', 'row', 'col')})
+    try:
+        deleted = clear_region(plate, region)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return jsonify({
+        'message': f"successfully emptied {len(deleted)} wells from plate {plate_id}!",
+        'deleted': deleted
+    })
+
+
+# Download a plate as a columnar file for liquid handlers and analysis pipelines
+@app.route('/plates/<plate_id>/export', methods=['GET'])
+def export(plate_id):
+    fmt = check_format(request.args.get('format', 'npz'))
+
+    def build():
+        plate = Plate.query.get(plate_id)
+        return export_plate(plate, fmt)
+    # left uncompressed so the file can be memory mapped as it lands
+    response = cached_plate_response(plate_id, f'export-{fmt}', build, mimetype=EXCHANGE_FORMATS[fmt],
+                                     compressible=False)
+    response.headers['Content-Disposition'] = f'attachment; filename=plate-{plate_id}.{fmt}'
+    return response
+
+
+# Load wells from a columnar file in the same layout the export writes
+@app.route('/plates/<plate_id>/import', methods=['POST'])
+def import_wells(plate_id):
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    fmt = check_format(request.args.get('format', 'npz'))
+    replace = request.args.get('replace', 'false').lower() in ('true', '1', 'yes')
+    # either a multipart upload or the raw file as the body
+    data = request.files['file'].read() if 'file' in request.files else request.get_data()
+
+    with StatementCounter() as counter:
+        try:
+            n_wells = import_plate(plate, data, fmt, replace=replace)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    return jsonify({
+        'message': f"successfully imported {n_wells} wells into plate {plate.name}!",
+        'n_wells': n_wells,
+        'n_statements': counter.count,
+        'elapsed_ms': round(counter.elapsed * 1000, 3)
+    })
+
+
+# Make replicate copies of a plate and everything on it
+@app.route('/plates/<plate_id>/clone', methods=['POST'])
+def clone(plate_id):
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    copies = request.args.get('copies', '1')
+    copies = int(copies) if copies.isdigit() else copies
+
+    with StatementCounter() as counter:
+        try:
+            new_ids = clone_plate(plate, copies)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+    clones = Plate.query.filter(Plate.id.in_(new_ids)).order_by(Plate.id).all()
+    return jsonify({
+        'message': f"successfully made {len(new_ids)} copies of plate {plate.name}!",
+        'plates': plate_summaries_schema.dump(clones),
+        'n_statements': counter.count,
+        'elapsed_ms': round(counter.elapsed * 1000, 3)
+    }), 201
+
+
+# Get only the wells that changed since a given plate version
+@app.route('/plates/<plate_id>/changes', methods=['GET'])
+def view_changes(plate_id):
+    since = request.args.get('since', 0, type=int)
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+
+    # collapse the log to the latest change per well
+    latest = select(func.max(WellChange.id)).where(
+        WellChange.plate_id == plate.id,
+        WellChange.version > since
+    ).group_by(WellChange.index)
+    changes = db.session.execute(
+        select(WellChange.index, WellChange.version, WellChange.op)
+        .where(WellChange.id.in_(latest))
+        .order_by(WellChange.index)
+    ).all()
+
+    # and pair each with what the well looks like now
+    changed_indices = [change.index for change in changes]
+    current_wells = {
+        well.index: well
+        for well in Well.query.options(subqueryload(Well.chemicals)).filter(
+            Well.plate_id == plate.id,
+            Well.index.in_(changed_indices)
+        )
+    }
+    return jsonify({
+        'plate_id': plate.id,
+        'since': since,
+        'version': plate.version,
+        'changes': [{
+            'index': change.index,
+            'version': change.version,
+            'op': change.op,
+            'well': well_schema.dump(current_wells.get(change.index) or EmptyWell(plate.id, change.index))
+        } for change in changes]
+    })
 
 
 # Delete data from a well
 @app.route('/plates/<plate_id>/wells/<row>/<col>', methods=['DELETE'])
 def delete_well(plate_id, row, col):
     plate_of_well = Plate.query.get(plate_id)
+    if not plate_of_well:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
     index_to_delete = plate_of_well.get_index(row=int(row), col=int(col))
-    well_to_delete = plate_of_well.well(index_to_delete)
-    db.session.delete(well_to_delete)
-    db.session.commit()
-    # plate_of_well.make_empty_well(index_to_delete, overwrite=True)
+    plate_of_well.make_empty_well(index_to_delete, overwrite=True)
     return jsonify(f"successfully deleted well ({row}, {col}) from plate {plate_id}!")
 
 
@@ -98,51 +445,253 @@ def view_all_chemicals():
     return chemicals_schema.jsonify(all_chemicals)
 
 
+# Find every well a chemical is in, optionally within a concentration range
+@app.route('/chemicals/<str_id>/wells', methods=['GET'])
+def view_chemical_wells(str_id):
+    min_conc = request.args.get('min_conc', type=float)
+    max_conc = request.args.get('max_conc', type=float)
+    plate_id = request.args.get('plate_id', type=int)
+    limit = request.args.get('limit', CHEMICAL_WELLS_PAGE_SIZE, type=int)
+    if limit < 1:
+        raise InvalidPlateData(f"limit must be at least 1, not '{limit}'.")
+    limit = min(limit, CHEMICAL_WELLS_MAX_PAGE_SIZE)
+    # keyset pagination on (concentration, well id), which is the order the
+    # (chemical_str_id, concentration, well_id) index already holds them in.
+    # wells without a concentration come last, as they do in an ascending
+    # postgres index; sqlite reads the same order off the index in two passes
+    after = request.args.get('after')
+
+    query = (
+        select(ChemicalInWell.well_id, ChemicalInWell.concentration, Well.plate_id, Well.index)
+        .join(Well, Well.id == ChemicalInWell.well_id)
+        .where(ChemicalInWell.chemical_str_id == str_id)
+        .order_by(ChemicalInWell.concentration.nulls_last(), ChemicalInWell.well_id)
+        .limit(limit)
+    )
+    if min_conc is not None:
+        query = query.where(ChemicalInWell.concentration >= min_conc)
+    if max_conc is not None:
+        query = query.where(ChemicalInWell.concentration <= max_conc)
+    if plate_id is not None:
+        query = query.where(Well.plate_id == plate_id)
+    if after:
+        try:
+            after_conc, after_well_id = after.rsplit(':', 1)
+            after_well_id = int(after_well_id)
+            after_conc = None if after_conc == 'null' else float(after_conc)
+        except ValueError:
+            raise InvalidPlateData(f"after must look like '<concentration>:<well id>', not '{after}'.")
+        if after_conc is None:
+            query = query.where(
+                ChemicalInWell.concentration.is_(None), ChemicalInWell.well_id > after_well_id
+            )
+        else:
+            query = query.where(or_(
+                ChemicalInWell.concentration > after_conc,
+                and_(ChemicalInWell.concentration == after_conc, ChemicalInWell.well_id > after_well_id),
+                ChemicalInWell.concentration.is_(None)
+            ))
+    rows = db.session.execute(query).all()
+
+    response = jsonify([
+        {'plate_id': row.plate_id, 'index': row.index, 'concentration': row.concentration}
+        for row in rows
+    ])
+    if rows and len(rows) == limit:
+        last = rows[-1]
+        cursor = f"{'null' if last.concentration is None else repr(last.concentration)}:{last.well_id}"
+        args = {name: request.args[name] for name in ('min_conc', 'max_conc', 'plate_id') if name in request.args}
+        args.update(limit=limit, after=cursor)
+        response.headers['Link'] = f'</chemicals/{str_id}/wells?{urlencode(args)}>; rel="next"'
+    return response
+
+
+# Usage totals across every plate, or for one plate, read from the summary tables
+@app.route('/stats', methods=['GET'])
+def view_stats():
+    plate_id = request.args.get('plate_id', type=int)
+    if plate_id is None:
+        return jsonify({
+            'chemicals': chemical_summaries_schema.dump(
+                ChemicalSummary.query.order_by(ChemicalSummary.chemical_str_id)
+            ),
+            'cell_lines': cell_line_summaries_schema.dump(
+                CellLineSummary.query.order_by(CellLineSummary.cell_line)
+            )
+        })
+
+    if not db.session.get(Plate, plate_id):
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    return jsonify({
+        'plate_id': plate_id,
+        'chemicals': plate_chemical_summaries_schema.dump(
+            PlateChemicalSummary.query.filter_by(plate_id=plate_id).order_by(PlateChemicalSummary.chemical_str_id)
+        ),
+        'cell_lines': plate_cell_line_summaries_schema.dump(
+            PlateCellLineSummary.query.filter_by(plate_id=plate_id).order_by(PlateCellLineSummary.cell_line)
+        )
+    })
+
+
 # Fill a plate with dose response Curve and control chemical data
 @app.route('/plates/<plate_id>/drc', methods=['POST'])
 def assign_dose_response_curves(plate_id):
 
     plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(
+            f"Plate {plate_id} doesn't exist yet!"
+        )
     # Unpack the request
     cell_line = request.json['cell_line']
     chemicals = request.json['chemicals']
-    min_concentration = request.json['min_concentration']
     max_concentration = request.json['max_concentration']
     n_points = request.json['n_points']
     control_chemical = request.json['control_chemical']
     control_concentration = request.json['control_concentration']
+    # optional curve layout settings
+    orientation = request.json.get('orientation', 'horizontal')
+    spacing = request.json.get('spacing', 'linear')
+    dilution_factor = request.json.get('dilution_factor')
+    replicates = request.json.get('replicates', 1)
+    # a serial dilution's lowest point follows from its dilution factor
+    if spacing == 'serial':
+        min_concentration = request.json.get('min_concentration')
+    else:
+        min_concentration = request.json['min_concentration']
 
-    if len(chemicals) * n_points > plate.size:
-        raise WellOutOfBounds(
-            f"Too many wells are needed to fit onto plate {plate.name} alone. "
-            f"Consider reducing the number of chemicals or the number of points in the response curve."
-        )
-    # Make a bunch of new drcs
-    starting_well_index = 0
-    for chemical in chemicals:
-        new_drc = DoseResponseCurve(
-            plate_id=plate_id,
-            starting_well_index=starting_well_index,
+    with StatementCounter() as counter:
+        # work out every curve and well up front so nothing is written if the plan is bad
+        plan = plan_dose_response_curves(
+            plate,
+            cell_line=cell_line,
+            chemicals=chemicals,
             min_concentration=min_concentration,
             max_concentration=max_concentration,
-            chemical=chemical,
-            n_points=n_points
+            n_points=n_points,
+            control_chemical=control_chemical,
+            control_concentration=control_concentration,
+            orientation=orientation,
+            spacing=spacing,
+            dilution_factor=dilution_factor,
+            replicates=replicates
         )
-        starting_well_index += n_points
-        db.session.add(new_drc)
-        db.session.commit()
+        n_wells = apply_dose_response_plan(plate, plan)
+    return jsonify({
+        'message': f"successfully added {n_points} point drc's to plate {plate.name} for {len(chemicals)} chemicals!",
+        'n_wells': n_wells,
+        'n_statements': counter.count,
+        'elapsed_ms': round(counter.elapsed * 1000, 3)
+    })
 
-    # populate the curve wells. Doing this after defining them to avoid
-    # partial data update due to an error
-    for drc in DoseResponseCurve.query.filter_by(plate_id=plate_id):
-        drc.populate_wells()
 
-    # Populate control wells
-    for index in range(starting_well_index, plate.size):
-        plate.set_well_data(index=index, chemicals=control_chemical, concentrations=control_concentration)
-        db.session.commit()
-    # assign cell line
-    for well in plate.all_wells():
-        well.cell_line = cell_line
+# Store a plate reader readout, one value per well
+@app.route('/plates/<plate_id>/readouts/<name>', methods=['PUT'])
+def put_readout(plate_id, name):
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    try:
+        n_wells = save_readout(plate, name, request.json['values'])
         db.session.commit()
-    return jsonify(f"successfully added {n_points} point drc's to plate {plate.name} for {len(chemicals)} chemicals!")
\ No newline at end of file
+    except Exception:
+        db.session.rollback()
+        raise
+    return jsonify({
+        'message': f"successfully stored readout {name} for {n_wells} wells of plate {plate.name}!",
+        'plate_id': plate.id,
+        'name': name,
+        'n_wells': n_wells
+    })
+
+
+@app.route('/plates/<plate_id>/readouts', methods=['GET'])
+def view_readouts(plate_id):
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    return jsonify({'plate_id': plate.id, 'readouts': readout_names(plate.id)})
+
+
+@app.route('/plates/<plate_id>/readouts/<name>', methods=['GET'])
+def view_readout(plate_id, name):
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    values = load_readout(plate.id, name)
+    if values is None:
+        raise PlateNotFound(f"Plate {plate_id} has no readout called {name}.")
+    return jsonify({
+        'plate_id': plate.id,
+        'name': name,
+        'values': readout_list(values)
+    })
+
+
+def curve_fits_response(plate_ids: List[int]) -> Response:
+    readout = request.args['readout']
+    with StatementCounter() as counter:
+        fits = fit_plate_curves(plate_ids, readout)
+    # elapsed_ms goes first to keep the keys sorted, as encode needs
+    return json_response(encode({'elapsed_ms': round(counter.elapsed * 1000, 3), **fits}))
+
+
+# Fit a 4 parameter logistic to every dose response curve on a plate against one of its readouts
+@app.route('/plates/<plate_id>/fits', methods=['GET'])
+def fit_plate(plate_id):
+    plate = Plate.query.get(plate_id)
+    if not plate:
+        raise PlateNotFound(f"{plate_id} doesn't exist yet!")
+    return curve_fits_response([plate.id])
+
+
+# The same for every plate in a campaign, all fit together
+@app.route('/campaigns/<campaign_id>/fits', methods=['GET'])
+def fit_campaign(campaign_id):
+    campaign = db.session.get(Campaign, campaign_id)
+    if not campaign:
+        raise PlateNotFound(
+            f"Campaign {campaign_id} doesn't exist yet!"
+        )
+    return curve_fits_response(campaign.plate_ids)
+
+
+# Spread dose response curves for a whole chemical library over as many plates as it needs
+@app.route('/campaigns', methods=['POST'])
+def add_campaign():
+    name = request.json['name']
+    plate_size = request.json['size']
+    chemicals = request.json['chemicals']
+    controls_per_plate = request.json.get('controls_per_plate', 0)
+    drc_settings = {
+        'cell_line': request.json['cell_line'],
+        'max_concentration': request.json['max_concentration'],
+        'min_concentration': request.json.get('min_concentration'),
+        'n_points': request.json['n_points'],
+        'control_chemical': request.json['control_chemical'],
+        'control_concentration': request.json['control_concentration'],
+        'orientation': request.json.get('orientation', 'horizontal'),
+        'spacing': request.json.get('spacing', 'linear'),
+        'dilution_factor': request.json.get('dilution_factor'),
+        'replicates': request.json.get('replicates', 1)
+    }
+    campaign = start_campaign(name, plate_size, chemicals, drc_settings, controls_per_plate=controls_per_plate)
+    return campaign_schema.jsonify(campaign), 202
+
+
+@app.route('/campaigns/<campaign_id>', methods=['GET'])
+def view_campaign(campaign_id):
+    campaign = db.session.get(Campaign, campaign_id)
+    if not campaign:
+        raise PlateNotFound(
+            f"Campaign {campaign_id} doesn't exist yet!"
+        )
+    return campaign_schema.jsonify(campaign)
+
+
+# Prometheus scrape target for the opt-in request and SQL instrumentation
+@app.route('/debug/metrics', methods=['GET'])
+def view_metrics():
+    if not metrics_enabled():
+        return Response("metrics are off. set METRICS_ENABLED to turn them on.\n", status=404, mimetype='text/plain')
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,139 @@
+import gzip
+import json
+from typing import List, Optional, Iterable, Tuple
+from sqlalchemy import select
+from app import app, db
+from model import Plate, Well, ChemicalInWell
+from metrics import timed
+
+# brotli is optional. without it responses are only ever gzipped
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# the same bytes Flask's jsonify writes: compact, ascii only, keys sorted. the
+# dicts below are built with their keys already in sorted order so the C
+# encoder doesn't have to sort anything
+_encoder = json.JSONEncoder(ensure_ascii=True, separators=(",", ":"))
+
+# responses smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 1024
+
+
+@timed('serialize_encode')
+def encode(data) -> bytes:
+    """serialize exactly like jsonify, trailing newline included"""
+    if (app.json.compact is None and app.debug) or app.json.compact is False:
+        # jsonify pretty prints in debug mode
+        return (json.dumps(data, indent=2, sort_keys=True) + "\n").encode()
+    return (_encoder.encode(data) + "\n").encode()
+
+
+def encode_line(data) -> str:
+    """one compact line of NDJSON"""
+    return _encoder.encode(data) + "\n"
+
+
+def well_rows(plate_ids: List[int], where=None) -> List[tuple]:
+    """
+    (plate_id, index, cell_line, chemical_str_id, concentration) for every
+    stored well on the plates, one row per well and chemical, in a single
+    outer joined query ordered by plate and well index
+    """
+    stmt = (
+        select(Well.plate_id, Well.index, Well.cell_line, ChemicalInWell.chemical_str_id, ChemicalInWell.concentration)
+        .outerjoin(ChemicalInWell, ChemicalInWell.well_id == Well.id)
+        .where(Well.plate_id.in_(plate_ids))
+        .order_by(Well.plate_id, Well.index)
+    )
+    if where is not None:
+        stmt = stmt.where(where)
+    return db.session.execute(stmt).all()
+
+
+@timed('serialize_build')
+def group_wells(rows: Iterable[tuple]) -> dict:
+    """fold well_rows into {plate_id: [well dict, ...]} in the shape WellSchema dumps"""
+    wells_by_plate = {}
+    well = None
+    last = None
+    for plate_id, index, cell_line, chemical_str_id, concentration in rows:
+        if (plate_id, index) != last:
+            last = (plate_id, index)
+            well = {'cell_line': cell_line, 'chemicals': [], 'index': index, 'plate_id': plate_id}
+            wells_by_plate.setdefault(plate_id, []).append(well)
+        if chemical_str_id is not None:
+            well['chemicals'].append({'chemical_str_id': chemical_str_id, 'concentration': concentration})
+    return wells_by_plate
+
+
+def empty_well(plate_id: int, index: int) -> dict:
+    return {'cell_line': None, 'chemicals': [], 'index': index, 'plate_id': plate_id}
+
+
+def well_dict(plate_id: int, index: int, cell_line: Optional[str], chemicals: List[str],
+              concentrations: List[Optional[float]]) -> dict:
+    """a well as WellSchema dumps it, from its contents rather than a stored row"""
+    return {
+        'cell_line': cell_line,
+        'chemicals': [
+            {'chemical_str_id': str_id, 'concentration': None if conc is None else float(conc)}
+            for str_id, conc in zip(chemicals, concentrations)
+        ],
+        'index': index,
+        'plate_id': plate_id
+    }
+
+
+def plate_dicts(plates: List[Tuple[int, Optional[str], int]], include_wells: bool = True) -> List[dict]:
+    """PlateSchema output for (id, name, size) tuples, with every plate's wells read in one query"""
+    wells_by_plate = group_wells(well_rows([plate[0] for plate in plates])) if include_wells and plates else {}
+    dumped = []
+    for plate_id, name, size in plates:
+        plate = {'id': plate_id, 'name': name, 'size': size}
+        if include_wells:
+            plate['wells'] = wells_by_plate.get(plate_id, [])
+        dumped.append(plate)
+    return dumped
+
+
+def plates_json(plates: List[Tuple[int, Optional[str], int]], include_wells: bool = True) -> bytes:
+    """what plates_schema.jsonify (or plate_summaries_schema) would send"""
+    return encode(plate_dicts(plates, include_wells))
+
+
+def plate_json(plate: Plate) -> bytes:
+    """what plate_schema.jsonify would send"""
+    return encode(plate_dicts([(plate.id, plate.name, plate.size)])[0])
+
+
+def wells_json(plate: Plate, where=None, indices: Optional[Iterable[int]] = None) -> bytes:
+    """
+    what wells_schema.jsonify sends for the plate's stored wells, optionally
+    narrowed by an extra condition. Passing indices lists exactly those
+    positions instead, with empty wells where nothing is stored.
+    """
+    wells = group_wells(well_rows([plate.id], where)).get(plate.id, [])
+    if indices is not None:
+        stored = {well['index']: well for well in wells}
+        wells = [stored.get(index) or empty_well(plate.id, index) for index in indices]
+    return encode(wells)
+
+
+def negotiate_encoding(accept_encodings) -> Optional[str]:
+    """the best compression the client accepts that we can do, if any"""
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accept_encodings[encoding]:
+            return encoding
+    return None
+
+
+def compress(body: bytes, encoding: Optional[str]) -> bytes:
+    if encoding == 'br':
+        return brotli.compress(body, quality=5)
+    if encoding == 'gzip':
+        return gzip.compress(body, compresslevel=6)
+    return body
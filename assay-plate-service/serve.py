@@ -0,0 +1,81 @@
+"""
+Serve the app with several worker processes so reads scale with cores,
+rather than Flask's single threaded debug server.
+
+    python serve.py [--bind 0.0.0.0:5000] [--workers N] [--threads N]
+
+Uses gunicorn (a process per worker, each with its own connection pools)
+when it's installed, otherwise waitress with workers * threads threads, and
+falls back to Flask's threaded development server when neither is.
+Workers default to ASSAY_WORKERS, or one per core.
+"""
+import argparse
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+try:
+    from gunicorn.app.base import BaseApplication
+except ImportError:
+    BaseApplication = None
+
+try:
+    import waitress
+except ImportError:
+    waitress = None
+
+
+def load_app():
+    # imported in each gunicorn worker after the fork, so no engine or pool is shared between processes
+    from app import app
+    from campaigns import resume_campaigns
+    # each worker may queue the same plates, but a plate is only ever filled once
+    resume_campaigns()
+    return app
+
+
+if BaseApplication is not None:
+    class GunicornServer(BaseApplication):
+        def __init__(self, options: dict):
+            self.options = options
+            super().__init__()
+
+        def load_config(self):
+            for name, value in self.options.items():
+                self.cfg.set(name, value)
+
+        def load(self):
+            return load_app()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--bind', default=os.environ.get('ASSAY_BIND', '127.0.0.1:5000'))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('ASSAY_WORKERS', os.cpu_count() or 1)))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('ASSAY_THREADS', 4)),
+                        help='threads per worker')
+    parser.add_argument('--timeout', type=int, default=int(os.environ.get('ASSAY_WORKER_TIMEOUT', 120)),
+                        help='seconds before a stuck worker is restarted')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if BaseApplication is not None:
+        GunicornServer({
+            'bind': args.bind,
+            'workers': args.workers,
+            'threads': args.threads,
+            'worker_class': 'gthread',
+            'timeout': args.timeout,
+        }).run()
+    elif waitress is not None:
+        host, port = args.bind.rsplit(':', 1)
+        waitress.serve(load_app(), host=host, port=int(port), threads=args.workers * args.threads)
+    else:
+        logger.warning("Neither gunicorn nor waitress is installed, using Flask's threaded development server.")
+        host, port = args.bind.rsplit(':', 1)
+        load_app().run(host=host, port=int(port), threaded=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,176 @@
+from typing import Iterable, List, Optional
+from sqlalchemy import select, insert, update, delete, event, func, case, or_, Row
+from app import db
+from model import Plate, Well, ChemicalInWell, PlateChemicalSummary, PlateCellLineSummary, ChemicalSummary, \
+    CellLineSummary, dialect_insert
+
+
+def refresh_plate_summaries(plate_ids: Iterable[int]) -> None:
+    """
+    Bring the usage summaries up to date for the given plates without
+    committing. Each plate's own rows are rebuilt from its wells, which costs
+    at most one plate's worth of wells, and the totals are moved on by the
+    difference between the plates' old and new rows rather than rolled up
+    again from every plate, so a write costs the same however big the
+    database is. The statement count is fixed however many plates, wells or
+    chemicals are involved.
+    """
+    plate_ids = sorted(set(plate_ids))
+    if not plate_ids:
+        return
+
+    # drop the plates' old rows, keeping them to take off the totals
+    old_chemicals = db.session.execute(
+        delete(PlateChemicalSummary)
+        .where(PlateChemicalSummary.plate_id.in_(plate_ids))
+        .returning(PlateChemicalSummary.chemical_str_id, PlateChemicalSummary.n_wells,
+                   PlateChemicalSummary.min_concentration, PlateChemicalSummary.max_concentration)
+    ).all()
+    old_cell_lines = db.session.execute(
+        delete(PlateCellLineSummary)
+        .where(PlateCellLineSummary.plate_id.in_(plate_ids))
+        .returning(PlateCellLineSummary.cell_line, PlateCellLineSummary.n_wells)
+    ).all()
+
+    # and build them again from what's on the plates now
+    new_chemicals = db.session.execute(
+        insert(PlateChemicalSummary).from_select(
+            ['plate_id', 'chemical_str_id', 'n_wells', 'min_concentration', 'max_concentration'],
+            select(
+                Well.plate_id,
+                ChemicalInWell.chemical_str_id,
+                func.count(),
+                func.min(ChemicalInWell.concentration),
+                func.max(ChemicalInWell.concentration)
+            )
+            .join(Well, Well.id == ChemicalInWell.well_id)
+            .where(Well.plate_id.in_(plate_ids))
+            .group_by(Well.plate_id, ChemicalInWell.chemical_str_id)
+        ).returning(PlateChemicalSummary.chemical_str_id, PlateChemicalSummary.n_wells,
+                    PlateChemicalSummary.min_concentration, PlateChemicalSummary.max_concentration)
+    ).all()
+    new_cell_lines = db.session.execute(
+        insert(PlateCellLineSummary).from_select(
+            ['plate_id', 'cell_line', 'n_wells'],
+            select(Well.plate_id, Well.cell_line, func.count())
+            .where(Well.plate_id.in_(plate_ids), Well.cell_line.is_not(None))
+            .group_by(Well.plate_id, Well.cell_line)
+        ).returning(PlateCellLineSummary.cell_line, PlateCellLineSummary.n_wells)
+    ).all()
+
+    update_chemical_totals(old_chemicals, new_chemicals)
+    update_cell_line_totals(old_cell_lines, new_cell_lines)
+
+
+def update_chemical_totals(removed: List[Row], added: List[Row]) -> None:
+    """
+    Take the removed per-plate rows off the chemical totals and add the new
+    ones on, as increments in the database rather than values worked out
+    here, so concurrent writers can't undo each other's counts. A min or max
+    is only looked up again across the plates when a removed row may have
+    held it, since nothing else says what the next one is.
+    """
+    deltas = {}
+    for rows, sign in ((removed, -1), (added, 1)):
+        for str_id, n_wells, low, high in rows:
+            delta = deltas.setdefault(str_id, {'chemical_str_id': str_id, 'n_wells': 0, 'n_plates': 0,
+                                               'min_concentration': None, 'max_concentration': None})
+            delta['n_wells'] += sign * n_wells
+            delta['n_plates'] += sign
+            if sign > 0:
+                delta['min_concentration'] = extreme(min, delta['min_concentration'], low)
+                delta['max_concentration'] = extreme(max, delta['max_concentration'], high)
+    if not deltas:
+        return
+
+    table = ChemicalSummary.__table__
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['chemical_str_id'],
+        set_={
+            'n_wells': table.c.n_wells + stmt.excluded.n_wells,
+            'n_plates': table.c.n_plates + stmt.excluded.n_plates,
+            'min_concentration': case(
+                (or_(table.c.min_concentration.is_(None),
+                     stmt.excluded.min_concentration < table.c.min_concentration), stmt.excluded.min_concentration),
+                else_=table.c.min_concentration
+            ),
+            'max_concentration': case(
+                (or_(table.c.max_concentration.is_(None),
+                     stmt.excluded.max_concentration > table.c.max_concentration), stmt.excluded.max_concentration),
+                else_=table.c.max_concentration
+            ),
+        }
+    ).returning(table.c.chemical_str_id, table.c.n_plates, table.c.min_concentration, table.c.max_concentration)
+    totals = {row.chemical_str_id: row for row in db.session.execute(stmt, list(deltas.values()))}
+
+    # a removed min or max at or beyond the new total could have been the only one
+    stale = {
+        str_id for str_id, n_wells, low, high in removed
+        if totals[str_id].n_plates > 0 and (
+            (low is not None and (totals[str_id].min_concentration is None or low <= totals[str_id].min_concentration))
+            or (high is not None and (totals[str_id].max_concentration is None or high >= totals[str_id].max_concentration))
+        )
+    }
+    if stale:
+        plates = PlateChemicalSummary.__table__
+        db.session.execute(
+            update(table)
+            .where(table.c.chemical_str_id.in_(stale))
+            .values(
+                min_concentration=select(func.min(plates.c.min_concentration))
+                .where(plates.c.chemical_str_id == table.c.chemical_str_id).scalar_subquery(),
+                max_concentration=select(func.max(plates.c.max_concentration))
+                .where(plates.c.chemical_str_id == table.c.chemical_str_id).scalar_subquery()
+            )
+        )
+    if any(row.n_plates <= 0 for row in totals.values()):
+        db.session.execute(delete(table).where(table.c.chemical_str_id.in_(deltas), table.c.n_plates <= 0))
+
+
+def update_cell_line_totals(removed: List[Row], added: List[Row]) -> None:
+    """take the removed per-plate rows off the cell line totals and add the new ones on, as increments"""
+    deltas = {}
+    for rows, sign in ((removed, -1), (added, 1)):
+        for cell_line, n_wells in rows:
+            delta = deltas.setdefault(cell_line, {'cell_line': cell_line, 'n_wells': 0, 'n_plates': 0})
+            delta['n_wells'] += sign * n_wells
+            delta['n_plates'] += sign
+    if not deltas:
+        return
+
+    table = CellLineSummary.__table__
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['cell_line'],
+        set_={
+            'n_wells': table.c.n_wells + stmt.excluded.n_wells,
+            'n_plates': table.c.n_plates + stmt.excluded.n_plates,
+        }
+    ).returning(table.c.n_plates)
+    if any(n_plates <= 0 for n_plates in db.session.scalars(stmt, list(deltas.values()))):
+        db.session.execute(delete(table).where(table.c.cell_line.in_(deltas), table.c.n_plates <= 0))
+
+
+def extreme(pick, current: Optional[float], value: Optional[float]) -> Optional[float]:
+    """min or max of two concentrations where None means there isn't one"""
+    if current is None:
+        return value
+    if value is None:
+        return current
+    return pick(current, value)
+
+
+def rebuild_summaries() -> None:
+    """refresh every plate, e.g. to fill the summary tables for an existing database"""
+    refresh_plate_summaries(db.session.scalars(select(Plate.id)).all())
+    db.session.commit()
+
+
+@event.listens_for(db.session, 'before_commit')
+def refresh_written_plate_summaries(session):
+    # every write path moves the plates it touches on to a new version, so the
+    # plates this transaction versioned are exactly the ones to refresh
+    plate_ids = session.info.get('plate_versions')
+    if plate_ids:
+        refresh_plate_summaries(list(plate_ids))
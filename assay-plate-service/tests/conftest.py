@@ -0,0 +1,28 @@
+"""
+Every test module shares one app and one throwaway database, so each test
+makes its own plates and reads them back by the ids it was given.
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+# point the app at a throwaway database before it's imported
+_test_dir = tempfile.mkdtemp(prefix='assay-tests-')
+os.environ['ASSAY_DATABASE_URI'] = f"sqlite:///{os.path.join(_test_dir, 'test.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import app, db  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def client():
+    with app.app_context():
+        db.create_all()
+    yield app.test_client()
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+    shutil.rmtree(_test_dir, ignore_errors=True)
@@ -0,0 +1,52 @@
+"""
+A plate's dose response curves must always describe what's on it, so
+fitting never runs against curves whose wells now hold something else.
+
+    cd assay-plate-service
+    python -m pytest tests
+"""
+import pytest
+
+DRC = {
+    'cell_line': 'c1', 'min_concentration': 0.01, 'max_concentration': 10, 'n_points': 8, 'spacing': 'log',
+    'control_chemical': 'O99', 'control_concentration': 1
+}
+
+
+@pytest.fixture
+def plate_id(client) -> int:
+    """a 96 well plate with curves for O1 to O4 and then O5 and O6 laid over them, and a readout to fit"""
+    plate_id = client.post('/plates', json={'name': 'curves', 'size': 96}).get_json()['id']
+    for chemicals in (['O1', 'O2', 'O3', 'O4'], ['O5', 'O6']):
+        response = client.post(f'/plates/{plate_id}/drc', json={**DRC, 'chemicals': chemicals})
+        assert response.status_code == 200, response.get_data(as_text=True)
+    response = client.put(f'/plates/{plate_id}/readouts/lum', json={'values': [float(i % 8) for i in range(96)]})
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return plate_id
+
+
+def fitted_chemicals(client, plate_id: int) -> list:
+    fits = client.get(f'/plates/{plate_id}/fits?readout=lum').get_json()
+    assert fits['n_curves'] == len(fits['fits'])
+    return sorted(fit['chemical'] for fit in fits['fits'])
+
+
+def test_drc_replaces_earlier_curves(client, plate_id):
+    assert fitted_chemicals(client, plate_id) == ['O5', 'O6']
+
+
+def test_writing_a_curve_well_drops_the_curve(client, plate_id):
+    # O5 runs along row A, so this takes its fourth point
+    client.post(f'/plates/{plate_id}/wells', json={'row': 0, 'col': 3, 'cell_line': 'c2'})
+    assert fitted_chemicals(client, plate_id) == ['O6']
+
+
+def test_clearing_curve_wells_drops_the_curves(client, plate_id):
+    response = client.delete(f'/plates/{plate_id}/wells?region=A1:H12')
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert fitted_chemicals(client, plate_id) == []
+
+
+def test_writing_control_wells_keeps_the_curves(client, plate_id):
+    client.post(f'/plates/{plate_id}/wells:batch', json={'wells': [{'index': 95, 'cell_line': 'c3'}]})
+    assert fitted_chemicals(client, plate_id) == ['O5', 'O6']
@@ -0,0 +1,60 @@
+"""
+Reading plates must cost the same number of SQL statements however many
+plates, wells and chemicals there are, so the plate endpoints never fall
+back to a query per plate, per well or per chemical.
+
+    cd assay-plate-service
+    python -m pytest tests
+"""
+from typing import List
+
+from metrics import StatementCounter
+from cache import plate_response_cache
+
+PLATE_COUNTS = (1, 5, 20)
+URLS = ('/plates', '/plates/{plate_id}', '/plates/{plate_id}/wells')
+# the plate read gets this many more wells, each with its own chemicals, at every step
+WELLS_PER_PLATE = 4
+
+
+def fill_plates(client, plate_ids: List[int], n_plates: int) -> None:
+    """
+    Add filled 96 well plates until plate_ids has n_plates, and fill
+    WELLS_PER_PLATE * n_plates wells of the first, the one read, with
+    chemicals no other well has, so the plate being read grows too.
+    """
+    while len(plate_ids) < n_plates:
+        plate_id = client.post('/plates', json={'name': f'plate {len(plate_ids)}', 'size': 96}).get_json()['id']
+        plate_ids.append(plate_id)
+        fill_wells(client, plate_id, range(WELLS_PER_PLATE))
+    fill_wells(client, plate_ids[0], range(WELLS_PER_PLATE * n_plates))
+
+
+def fill_wells(client, plate_id: int, indices) -> None:
+    response = client.post(f'/plates/{plate_id}/wells:batch', json={'wells': [
+        {'index': index, 'cell_line': f'c{index % 3 + 1}', 'chemical': [f'O{index + 1}', f'O{index + 1001}'],
+         'concentration': [float(index), 1.0]}
+        for index in indices
+    ]})
+    assert response.status_code == 200, response.get_data(as_text=True)
+
+
+def count_statements(client, url: str) -> int:
+    # a cached response would skip the queries being counted
+    plate_response_cache.clear()
+    with StatementCounter() as counter:
+        response = client.get(url)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return counter.count
+
+
+def test_statement_count_does_not_grow(client):
+    # every url is counted at every size, since the database only ever grows
+    plate_ids = []
+    counts = {url: {} for url in URLS}
+    for n_plates in PLATE_COUNTS:
+        fill_plates(client, plate_ids, n_plates)
+        for url in URLS:
+            counts[url][n_plates] = count_statements(client, url.format(plate_id=plate_ids[0]))
+    for url, by_size in counts.items():
+        assert len(set(by_size.values())) == 1, f"{url} issued {by_size} statements as the plate and the database grew"
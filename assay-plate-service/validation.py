@@ -0,0 +1,106 @@
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+import numpy as np
+from exceptions import InvalidWellContents, WellOutOfBounds
+from model import Plate, check_concentration
+
+
+def identifier_errors(values: Iterable, check: Callable) -> Dict[str, str]:
+    """
+    Every distinct value that fails check (check_cell_line or
+    check_chemical_str_id), and why, in the order they first appear. A
+    payload naming the same few identifiers thousands of times only pays for
+    each one once.
+    """
+    errors = {}
+    for value in dict.fromkeys(values):
+        try:
+            check(value)
+        except InvalidWellContents as e:
+            errors[value] = str(e)
+    return errors
+
+
+def concentration_errors(concentrations: Sequence[Optional[float]]) -> Dict[int, str]:
+    """
+    The positions of the bad concentrations in a flat list, and why. When
+    everything is a number or None the whole list is checked as one array,
+    and only what fails is looked at one by one for its message.
+    """
+    if not len(concentrations):
+        return {}
+    if {type(conc) for conc in concentrations} <= {int, float, type(None)}:
+        values = np.array(concentrations, dtype=float)
+        missing = np.fromiter((conc is None for conc in concentrations), dtype=bool, count=len(concentrations))
+        with np.errstate(invalid='ignore'):
+            suspect = np.flatnonzero(~missing & ~(np.isfinite(values) & (values >= 0)))
+    else:
+        suspect = range(len(concentrations))
+    errors = {}
+    for position in suspect:
+        try:
+            check_concentration(concentrations[position])
+        except InvalidWellContents as e:
+            errors[int(position)] = str(e)
+    return errors
+
+
+def integers(values: Sequence[int]) -> Optional[np.ndarray]:
+    """values as an int64 array, or None if any of them don't fit in one"""
+    try:
+        return np.array(values, dtype=np.int64)
+    except OverflowError:
+        return None
+
+
+def position_errors(plate: Plate,
+                    indices: Sequence[Optional[int]],
+                    rows: Sequence[Optional[int]],
+                    cols: Sequence[Optional[int]]) -> Tuple[np.ndarray, Dict[int, str]]:
+    """
+    Well indices for a batch of positions, each given either as an index or
+    as a row and col (None for whichever wasn't), with every position
+    bounds checked as an array. Returns the indices and, for any position
+    that's off the plate, why.
+    """
+    has_index = np.array([index is not None for index in indices], dtype=bool)
+
+    def locate(position: int) -> int:
+        if has_index[position]:
+            plate.check_index(indices[position])
+            return indices[position]
+        return plate.get_index(rows[position], cols[position])
+
+    index = integers([-1 if i is None else i for i in indices])
+    row = integers([-1 if r is None else r for r in rows])
+    col = integers([-1 if c is None else c for c in cols])
+    if index is None or row is None or col is None:
+        # something doesn't even fit in an int64, so go one at a time
+        index = np.full(len(indices), -1, dtype=np.int64)
+        suspect = range(len(indices))
+    else:
+        num_rows, num_cols = plate.shape
+        on_plate = np.where(
+            has_index,
+            (index >= 0) & (index < plate.size),
+            (row >= 0) & (row < num_rows) & (col >= 0) & (col < num_cols)
+        )
+        index = np.where(has_index, index, row * num_cols + col)
+        suspect = np.flatnonzero(~on_plate)
+
+    errors = {}
+    for position in suspect:
+        try:
+            index[position] = locate(position)
+        except WellOutOfBounds as e:
+            errors[int(position)] = str(e)
+    return index, errors
+
+
+def first_occurrences(values: np.ndarray) -> np.ndarray:
+    """for every value, the position where it first appears"""
+    _, first, inverse = np.unique(values, return_index=True, return_inverse=True)
+    return first[inverse.ravel()]
+
+
+def errors_list(errors: Dict[int, str], key: str = 'entry') -> List[dict]:
+    return [{key: position, 'error': error} for position, error in sorted(errors.items())]